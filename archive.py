@@ -0,0 +1,164 @@
+"""
+archive - Parquet export and import of a whole tennis-datafier database
+
+export() writes player, tournament, player_tournament and match to one
+Parquet file each in a directory. Ids are int32, set scores (the
+score_columns ones) int8, and the few-valued text columns,
+surface, class, round and status, are dictionary encoded.
+
+load() bulk loads such a directory into an empty database, then builds
+the derived tables from it. Ratings are computed when next asked for.
+import_log goes along too, so files already imported are still skipped
+when unchanged.
+
+Set score columns holding something other than a number (the whole
+score, for walkovers and byes) are exported as nulls, and load() 
+derives them from score again with score_columns. Requires pyarrow.
+"""
+
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import tennis_datafier
+
+BATCH = 65536
+
+TEXT = pa.string()
+CODE = pa.dictionary(pa.int32(), pa.string())
+ID = pa.int32()
+GAMES = pa.int8()
+
+SCORES = [('score_{}_{}'.format(kind, i), GAMES)
+        for i in range(1, 4) for kind in ('w', 'l', 'tb')]
+
+TABLES = {
+        'player': [('p_id', ID), ('firstname', TEXT), ('lastname', TEXT),
+            ('country', TEXT)],
+        'tournament': [('t_id', ID), ('city', TEXT), ('name', TEXT),
+            ('country', TEXT), ('date', TEXT), ('surface', CODE),
+            ('class', CODE)],
+        'player_tournament': [('t_id', ID), ('p_id', ID),
+            ('status', CODE)],
+        'match': [('round', CODE), ('t_id', ID), ('winner', ID),
+            ('loser', ID), ('score', TEXT)] + SCORES,
+        'import_log': [('path', TEXT), ('hash', TEXT), ('t_ids', TEXT),
+            ('date', TEXT)],
+        }
+
+OPTIONAL = ('import_log',)
+"""tables that archives written before they were exported lack"""
+
+def column(values, kind):
+    if kind == CODE:
+        return pa.array(values, type=TEXT).dictionary_encode()
+    return pa.array(values, type=kind)
+
+def restore_scores(row):
+    """
+    A match row as loaded, with its set score columns derived from score
+    again if they were all exported as nulls
+    """
+    if row[4] is None or any(v is not None for v in row[5:]):
+        return row
+    return row[:5] + tennis_datafier.score_columns(row[4])[1:]
+
+def export(d, directory):
+    """
+    Write db d to directory as Parquet; returns {table: rows written}
+    """
+    os.makedirs(directory, exist_ok=True)
+    c = d.conn.cursor()
+    counts = {}
+    for table, fields in TABLES.items():
+        schema = pa.schema([pa.field(name, kind) for name, kind in fields])
+        writer = pq.ParquetWriter(os.path.join(directory,
+            table + '.parquet'), schema, compression='zstd')
+
+        columns = [tennis_datafier.games_sql(name) if kind == GAMES 
+                else name for name, kind in fields]
+        c.execute('SELECT ' + ', '.join(columns) + ' FROM ' + table + 
+                ' ORDER BY ' + fields[0][0])
+        counts[table] = 0
+        rows = c.fetchmany(BATCH)
+        while rows:
+            columns = zip(*rows)
+            writer.write_table(pa.Table.from_arrays(
+                [column(list(values), kind)
+                    for values, (name, kind) in zip(columns, fields)],
+                schema=schema))
+            counts[table] += len(rows)
+            rows = c.fetchmany(BATCH)
+        writer.close()
+
+    c.close()
+    return counts
+
+def load(d, directory):
+    """
+    Bulk load a directory written by export() into db d, which must have
+    no players, tournaments or matches yet. Returns {table: rows read}.
+    """
+    c = d.conn.cursor()
+    for table in TABLES:
+        c.execute('SELECT count(*) FROM ' + table)
+        if c.fetchone()[0]:
+            raise ValueError('the database already has a ' + table +
+                    ' table with rows in it')
+
+    counts = {}
+    try:
+        triggers = d.drop_triggers(c, ['match_record_insert',
+            'match_rating_insert'])
+
+        # indexes are quicker to build once, over the loaded tables
+        c.execute("SELECT name, sql FROM sqlite_master WHERE type='index' "
+                'AND sql IS NOT NULL AND tbl_name IN (' + 
+                ', '.join('?' * len(TABLES)) + ')', list(TABLES))
+        indexes = c.fetchall()
+        for name, sql in indexes:
+            c.execute('DROP INDEX ' + name)
+
+        for table, fields in TABLES.items():
+            names = [name for name, kind in fields]
+            sql = ('INSERT INTO ' + table + '(' + ', '.join(names) + ') '
+                    'VALUES (' + ', '.join('?' * len(names)) + ')')
+            path = os.path.join(directory, table + '.parquet')
+            if table in OPTIONAL and not os.path.exists(path):
+                continue
+            f = pq.ParquetFile(path)
+
+            counts[table] = 0
+            for batch in f.iter_batches(batch_size=BATCH, columns=names):
+                columns = []
+                for name, kind in fields:
+                    values = batch.column(batch.schema.get_field_index(
+                        name)).to_pylist()
+                    # set scores are stored as text, as the importers
+                    # write them
+                    if kind == GAMES:
+                        values = [None if v is None else str(v)
+                                for v in values]
+                    columns += [values]
+                rows = zip(*columns)
+                if table == 'match':
+                    rows = [restore_scores(r) for r in rows]
+                c.executemany(sql, rows)
+                counts[table] += batch.num_rows
+
+        for name, sql in indexes:
+            c.execute(sql)
+        for trigger in triggers:
+            c.execute(trigger)
+        d.rebuild_player_vs_record(c)
+        d.rebuild_match_set(c)
+        c.execute("UPDATE info SET value=0 WHERE key='rating_dirty'")
+        c.execute('ANALYZE')
+    except:
+        d.rollback()
+        raise
+
+    d.conn.commit()
+    c.close()
+    return counts
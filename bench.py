@@ -0,0 +1,705 @@
+#!/usr/bin/env python
+"""
+bench - timing harness for tennis-datafier
+
+Builds synthetic databases and times the query and import paths, so
+changes to the schema or the engines can be compared before and after.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import tennis_datafier
+
+SURFACES = ['Hard', 'Indoor Hard', 'Red Clay', 'Green Clay', 'Grass',
+        'Carpet', 'Indoor Carpet']
+
+def synthetic_db(filename, matches, players=3000, seed=1):
+    """
+    Fill a fresh database with roughly 'matches' random matches.
+
+    Tournaments are 32-player knockout draws spread over 30 years.
+    """
+    random.seed(seed)
+    d = tennis_datafier.db(filename)
+    c = d.conn.cursor()
+
+    c.executemany('INSERT INTO player(p_id, firstname, lastname, country) '
+            'VALUES (?, ?, ?, ?)',
+            [(i, 'First{}'.format(i), 'Last{}'.format(i), 'USA')
+                for i in range(1, players + 1)])
+
+    t_count = matches // 31 + 1
+    tournaments = []
+    entries = []
+    rows = []
+    for t in range(1, t_count + 1):
+        date = '{}-{:02}-{:02}'.format(random.randint(1985, 2014),
+                random.randint(1, 12), random.randint(1, 28))
+        tournaments += [(t, 'City{}'.format(t % 500), 'Open{}'.format(t),
+            'USA', date, random.choice(SURFACES), 'Premier')]
+
+        field = random.sample(range(1, players + 1), 32)
+        entries += [(t, p, '') for p in field]
+        rnd = 1
+        while len(field) > 1 and len(rows) < matches:
+            winners = []
+            for i in range(0, len(field), 2):
+                w, l = field[i], field[i + 1]
+                if random.random() < 0.5:
+                    w, l = l, w
+                rows += [('R{}'.format(rnd), t, w, l, '6-3 6-4',
+                    '6', '3', None, '6', '4', None, None, None, None)]
+                winners += [w]
+            field = winners
+            rnd += 1
+
+    c.executemany('INSERT INTO tournament'
+            '(t_id, city, name, country, date, surface, class) '
+            'VALUES (?,?,?,?,?,?,?)', tournaments)
+    c.executemany('INSERT INTO player_tournament(t_id, p_id, status) '
+            'VALUES (?,?,?)', entries)
+    c.executemany('INSERT INTO match'
+            '(round, t_id, winner, loser, score, '
+            ' score_w_1, score_l_1, score_tb_1,'
+            ' score_w_2, score_l_2, score_tb_2,'
+            ' score_w_3, score_l_3, score_tb_3)'
+            'VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)', rows)
+    d.conn.commit()
+    c.close()
+    return d
+
+def synthetic_text(filename, matches, players=3000, seed=1):
+    """
+    Write roughly 'matches' random matches as a text-data file of 
+    32-player draws
+    """
+    random.seed(seed)
+    f = open(filename, 'w', encoding='latin1')
+    written = 0
+    t = 0
+    while written < matches:
+        t += 1
+        f.write('Start\nCity{0}; Open{0}; USA\n{1}-{2:02}-{3:02}; {4}; '
+                'Premier\n:\n'.format(t, random.randint(1985, 2014),
+                    random.randint(1, 12), random.randint(1, 28),
+                    random.choice(SURFACES)))
+        field = random.sample(range(1, players + 1), 32)
+        rnd = 1
+        while len(field) > 1:
+            winners = []
+            for i in range(0, len(field), 2):
+                w, l = field[i], field[i + 1]
+                f.write('R{0} "Last{1}, First{1}"[USA] '
+                        '"Last{2}, First{2}"[FRA][{3}] 6-3 4-6 7-6(5);\n'.
+                        format(rnd, w, l, i + 1))
+                winners += [w]
+            field = winners
+            rnd += 1
+            written += len(winners)
+        f.write('Stop\n')
+    f.close()
+
+def timed(label, fn, repeat=5):
+    """Run fn 'repeat' times with stdout discarded, print the best time"""
+    best = None
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    print('{:<40} {:10.2f} ms'.format(label, best * 1000))
+    return best
+
+def query_suite(d, players, derived=True):
+    """
+    Time the action_* queries against 'players'; derived is False if 
+    the database has no derived tables or day numbers yet
+    """
+    timed('print_record', lambda: d.print_record(players[0], None, None))
+    if derived:
+        timed('print_record (dated)',
+                lambda: d.print_record(players[0], '2000-01-01', '2009-12-31'))
+    timed('action_record (50 players)',
+            lambda: d.action_record(players, None, None))
+    timed('action_h2h (4 players)',
+            lambda: d.action_h2h(players[:4], None, None))
+    timed('action_h2h_matrix (50 players)',
+            lambda: d.action_h2h_matrix(players, 'csv', None, None))
+
+    if not derived:
+        return
+
+    for op in ('best', 'rivals'):
+        timed('action_best_worst {} 10'.format(op),
+                lambda: d.action_best_worst(players[:1], '10', op))
+        # a start date that isn't a year boundary forces the query 
+        # straight from match
+        timed('action_best_worst {} 10 (from match)'.format(op),
+                lambda: d.action_best_worst(players[:1], '10', op,
+                    '1900-01-02'))
+
+V1_TABLES = {
+        'info': {'key', 'value'},
+        'player': {'p_id', 'firstname', 'lastname', 'country'},
+        'tournament': {'t_id', 'city', 'name', 'country', 'date',
+            'surface', 'class'},
+        'player_tournament': {'t_id', 'p_id', 'status'},
+        'match': {'round', 't_id', 'winner', 'loser', 'score',
+            'score_w_1', 'score_l_1', 'score_w_2', 'score_l_2',
+            'score_w_3', 'score_l_3', 'score_tb_1', 'score_tb_2',
+            'score_tb_3'},
+        }
+"""the version 1 schema"""
+
+def strip_to_v1(conn):
+    """Remove everything later migrations added to a database"""
+    c = conn.cursor()
+    c.execute('SELECT type, name FROM sqlite_master '
+            'WHERE type IN ("trigger", "index", "table") AND sql IS NOT NULL '
+            # dropping a table drops its indexes and triggers with it, so
+            # they go first
+            'ORDER BY type = "table"')
+    for kind, name in c.fetchall():
+        if kind != 'table':
+            c.execute('DROP {} {}'.format(kind, name))
+        elif name not in V1_TABLES:
+            c.execute('DROP TABLE {}'.format(name))
+
+    for table, columns in V1_TABLES.items():
+        c.execute('PRAGMA table_info({})'.format(table))
+        for column in [r[1] for r in c.fetchall()]:
+            if column not in columns:
+                c.execute('ALTER TABLE {} DROP COLUMN {}'.
+                        format(table, column))
+
+    c.execute('DROP TABLE IF EXISTS sqlite_stat1')
+    c.execute('DELETE FROM info WHERE key != "version"')
+    c.execute('UPDATE info SET value=1 WHERE key="version"')
+    conn.commit()
+    c.close()
+
+def bench_indexes(args):
+    """Query times on a version 1 database, then after migrating"""
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'bench.db')
+        print('Building synthetic database with {} matches...'.
+                format(args.matches))
+        d = synthetic_db(filename, args.matches)
+
+        strip_to_v1(d.conn)
+
+        players = ['Last{0}, First{0}'.format(i) for i in range(1, 51)]
+
+        print()
+        print('Before migration (version 1):')
+        query_suite(d, players, derived=False)
+        d.conn.close()
+
+        start = time.perf_counter()
+        d = tennis_datafier.db(filename)
+        print()
+        print('Migration: {:.2f} s'.format(time.perf_counter() - start))
+        print()
+        print('After migration (version {}):'.format(d.DB_VERSION))
+        query_suite(d, players)
+        d.conn.close()
+
+def bench_dates(args):
+    """
+    Dated queries over many different date ranges, with the statement 
+    cache turned off and then on
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'bench.db')
+        print('Building synthetic database with {} matches...'.
+                format(args.matches))
+        d = synthetic_db(filename, args.matches)
+        pids = list(range(1, 51))
+
+        ranges = [('{}-{:02}'.format(y, m), '{}-{:02}'.format(y + 5, m))
+                for y in range(1985, 2010) for m in range(1, 13)]
+
+        def run():
+            for start, end in ranges:
+                d.records(pids[:1], start, end)
+                d.undefeated(pids[:1], start, end)
+                d.print_matches(pids[0], 10, start, end)
+
+        print()
+        print('{} date ranges, 3 queries each:'.format(len(ranges)))
+        for size in (0, d.STATEMENT_CACHE_SIZE):
+            d.conn.close()
+            d.STATEMENT_CACHE_SIZE = size
+            d.conn = tennis_datafier.sqlite3.connect(filename,
+                    cached_statements=size)
+            timed('statement cache of {}'.format(size), run, args.repeat)
+        d.conn.close()
+
+def import_times():
+    """
+    [(module, cumulative microseconds, nesting)] for everything a cold 
+    'import tennis_datafier' loads, from python -X importtime; 
+    tennis_datafier itself is last
+    """
+    # from the repository, so the import finds it wherever bench is run
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+        'import tennis_datafier'], stderr=subprocess.PIPE,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        universal_newlines=True, check=True).stderr
+
+    times = []
+    for line in err.splitlines()[1:]:
+        self_us, cumulative, name = line.split(':', 1)[1].split('|')
+        times += [(name.strip(), int(cumulative), 
+            len(name) - len(name.lstrip()))]
+
+    # modules are listed as they finish loading, so its own imports are
+    # the deeper-nested run of lines just before it
+    end = [t[0] for t in times].index('tennis_datafier')
+    start = end
+    while start > 0 and times[start - 1][2] > times[end][2]:
+        start -= 1
+    return times[start:end + 1]
+
+def bench_startup(args):
+    """Cold-start cost of the CLI: imports, then whole query runs"""
+    best = None
+    for i in range(args.repeat):
+        times = import_times()
+        if best is None or times[-1][1] < best[-1][1]:
+            best = times
+
+    name, us, depth = best[-1]
+    print('import tennis_datafier: {:.1f} ms'.format(us / 1000))
+    for name, us, indent in sorted(best[:-1], key=lambda a: -a[1]):
+        # only the modules it imports directly
+        if indent == depth + 2:
+            print('    {:<30} {:8.1f} ms'.format(name, us / 1000))
+
+    loaded = [t[0] for t in best]
+    for name in ('drawsheet', 'readline', 'argparse'):
+        print('{} loaded: {}'.format(name, name in loaded))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'bench.db')
+        synthetic_db(filename, 10000).conn.close()
+
+        print()
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                'tennis_datafier.py')
+        for query in (['-p', 'Last1, First1'], ['-2', 'Last1', 'Last2']):
+            def run():
+                subprocess.run([sys.executable, script, '-d', filename] +
+                        query, stdout=subprocess.DEVNULL, check=True)
+            timed('tennis_datafier.py ' + ' '.join(query), run, args.repeat)
+
+def bench_text(args):
+    """
+    parse_text_data on its own, then feeding the bulk loader, over
+    text-data files or a synthetic one
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        files = args.files
+        if not files:
+            files = [os.path.join(tmp, 'bench.txt')]
+            print('Writing synthetic text-data with {} matches...'.
+                    format(args.matches))
+            synthetic_text(files[0], args.matches)
+
+        size = sum(os.path.getsize(f) for f in files)
+
+        def parse():
+            records = 0
+            for filename in files:
+                f = open(filename, encoding='latin1')
+                for record in tennis_datafier.parse_text_data(f):
+                    records += 1
+                f.close()
+            return records
+
+        start = time.perf_counter()
+        records = parse()
+        elapsed = time.perf_counter() - start
+        print('parse: {} records, {:.1f} MB in {:.2f} s '
+                '({:.0f} records/sec, {:.1f} MB/s)'.format(records, 
+                    size / 1e6, elapsed, records / elapsed, 
+                    size / 1e6 / elapsed))
+
+        tracemalloc.start()
+        parse()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('parse: peak memory {:.2f} MB'.format(peak / 1e6))
+
+        for jobs in [1] + args.jobs:
+            print('load with {} parsing jobs:'.format(jobs or 'default'))
+            d = tennis_datafier.db(os.path.join(tmp, 
+                'bench{}.db'.format(jobs)))
+            for filename in files:
+                d.insert_file_text_data_bulk(filename, jobs=jobs or None)
+            d.conn.close()
+
+def bench_elo(args):
+    """Elo ratings: a full recompute, then incremental updates after a
+    new draw and a backdated one"""
+    with tempfile.TemporaryDirectory() as tmp:
+        print('Building synthetic database with {} matches...'.format(
+            args.matches))
+        d = synthetic_db(os.path.join(tmp, 'bench.db'), args.matches)
+        c = d.conn.cursor()
+
+        def add_draw(date):
+            c.execute('INSERT INTO tournament(city, name, country, date, '
+                    "surface, class) VALUES ('City', 'Open', 'USA', ?, "
+                    "'Hard', 'Premier')", [date])
+            t_id = c.lastrowid
+            field = list(range(1, 33))
+            rnd = 1
+            while len(field) > 1:
+                c.executemany('INSERT INTO match(round, t_id, winner, '
+                        "loser, score, score_w_1, score_l_1) "
+                        "VALUES (?, ?, ?, ?, '6-3 6-4', '6', '3')",
+                        [('R{}'.format(rnd), t_id, field[i], field[i + 1])
+                            for i in range(0, len(field), 2)])
+                field = field[::2]
+                rnd += 1
+
+        for label, prepare in (('full recompute', lambda: None),
+                ('new draw', lambda: add_draw('2015-01-05')),
+                ('draw from 2010', lambda: add_draw('2010-06-07'))):
+            prepare()
+            start = time.perf_counter()
+            if label == 'full recompute':
+                rated = d.rebuild_ratings(c)
+            else:
+                rated = d.update_ratings(c)
+            elapsed = time.perf_counter() - start
+            d.conn.commit()
+            print('{:<40} {:10.2f} ms  ({} matches rated)'.format(label, 
+                elapsed * 1000, rated))
+        d.conn.close()
+
+def bench_snapshot(args):
+    """The numpy snapshot: export and load, then records and h2h from
+    it against the same queries in SQLite"""
+    import snapshot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print('Building synthetic database with {} matches...'.format(
+            args.matches))
+        d = synthetic_db(os.path.join(tmp, 'bench.db'), args.matches)
+        directory = os.path.join(tmp, 'snapshot')
+
+        timed('export', lambda: snapshot.export(d, directory), 1)
+        timed('load', lambda: snapshot.snapshot(directory), args.repeat)
+        s = snapshot.snapshot(directory)
+
+        pids = list(range(1, args.players + 1))
+        for label, start, end in (('', None, None),
+                (' 2000-2004', '2000', '2004')):
+            timed('records x{}{} sqlite'.format(len(pids), label),
+                    lambda: d.records(pids, start, end), args.repeat)
+            timed('records x{}{} snapshot'.format(len(pids), label),
+                    lambda: s.splits(pids, start, end), args.repeat)
+            timed('h2h {0}x{0}{1} sqlite'.format(len(pids), label),
+                    lambda: d.h2h_matrix(pids, start, end), args.repeat)
+            timed('h2h {0}x{0}{1} snapshot'.format(len(pids), label),
+                    lambda: s.h2h(pids, start, end), args.repeat)
+        d.conn.close()
+
+def bench_parquet(args):
+    """Round trip through a Parquet archive: export, import and sizes"""
+    import archive
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print('Building synthetic database with {} matches...'.format(
+            args.matches))
+        filename = os.path.join(tmp, 'bench.db')
+        d = synthetic_db(filename, args.matches)
+        directory = os.path.join(tmp, 'archive')
+
+        timed('export', lambda: archive.export(d, directory), 1)
+        d.conn.close()
+
+        copy = os.path.join(tmp, 'copy.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            d = tennis_datafier.db(copy)
+        timed('import', lambda: archive.load(d, directory), 1)
+        d.conn.close()
+
+        size = sum(os.path.getsize(os.path.join(directory, f))
+                for f in os.listdir(directory))
+        print('sqlite {:.1f} MB, parquet {:.1f} MB ({:.0%})'.format(
+            os.path.getsize(filename) / 1e6, size / 1e6, 
+            size / os.path.getsize(filename)))
+
+def bench_names(args):
+    """PLAYER resolution: loading the resolver, then exact, prefix and
+    fuzzy lookups"""
+    with tempfile.TemporaryDirectory() as tmp:
+        d = synthetic_db(os.path.join(tmp, 'bench.db'), 1000, args.players)
+
+        # FirstN LastN names all share most of their trigrams, which real
+        # names don't; make up pronounceable ones instead
+        random.seed(1)
+        syllables = ['ka', 'ro', 'li', 'na', 'vi', 'tes', 'mar', 'sha',
+                'ov', 'el', 'dra', 'ni', 'ko', 'va', 'ber', 'gu', 'zi', 'an']
+        def made_up(parts):
+            return ''.join(random.choice(syllables) 
+                    for i in range(parts)).capitalize()
+        names = {}
+        for p in range(1, args.players + 1):
+            names[p] = (made_up(2), made_up(3))
+        d.conn.executemany('UPDATE player SET firstname=?, lastname=? '
+                'WHERE p_id=?', [n + (p,) for p, n in names.items()])
+        d.conn.commit()
+
+        def load():
+            d.players = None
+            d.resolver()
+        timed('load resolver, {} players'.format(args.players), load, 
+                args.repeat)
+
+        first, last = names[args.players // 2]
+        typo = last[:2] + last[3] + last[2] + last[4:]
+        for label, name in (('exact', last + ', ' + first),
+                ('last name', last),
+                ('prefix', last[:4]),
+                ('typo', typo + ', ' + first),
+                ('no match', 'Qwxyz')):
+            def lookup():
+                for i in range(1000):
+                    d.get_pids(name, announce=False)
+            # fuzzy lookups build the trigram index on first use
+            d.get_pids(name, announce=False)
+            best = timed('get_pids {} x1000'.format(label), lookup, 
+                    args.repeat)
+            print('    {} results, {:.1f} us each'.format(
+                len(d.get_pids(name, announce=False)), best * 1000))
+        d.conn.close()
+
+def random_score(sets=3):
+    """A made-up score, with tiebreaks, long final sets and retirements"""
+    r = random.random()
+    if r < 0.01:
+        return 'w.o.'
+
+    scores = []
+    for i in range(random.choice(range(sets // 2 + 1, sets + 1))):
+        w = random.choice([6, 6, 6, 7, 7])
+        l = random.randint(0, 4) if w == 6 else random.choice([5, 6])
+        if i == sets - 1 and random.random() < 0.1:
+            w = random.randint(8, 20)
+            l = w - 2
+        s = '{}-{}'.format(w, l)
+        if l == 6:
+            s += '({})'.format(random.randint(0, 12))
+        scores += [s]
+    if r > 0.97:
+        scores[-1] = '{}-{}'.format(random.randint(0, 5), 
+                random.randint(0, 5))
+        scores += ['ret.']
+    return ' '.join(scores)
+
+def bench_scores(args):
+    """The score parser, uncached and cached, and building match_set"""
+    random.seed(1)
+    scores = [random_score(random.choice([3, 5])) 
+            for i in range(args.scores)]
+    print('{} scores, {} distinct'.format(len(scores), len(set(scores))))
+
+    def parse(fn):
+        tennis_datafier.parse_score.cache_clear()
+        for s in scores:
+            fn(s)
+
+    timed('parse_score, uncached', 
+            lambda: parse(tennis_datafier.parse_score.__wrapped__))
+    timed('parse_score, cached', 
+            lambda: parse(tennis_datafier.parse_score))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print('Building synthetic database with {} matches...'.format(
+            args.matches))
+        d = synthetic_db(os.path.join(tmp, 'bench.db'), args.matches)
+        c = d.conn.cursor()
+        c.executemany('UPDATE match SET score=? WHERE rowid=?', 
+                [(random.choice(scores), i + 1) 
+                    for i in range(args.matches)])
+        d.conn.commit()
+
+        timed('rebuild match_set', lambda: d.rebuild_match_set(c), 
+                repeat=1)
+        c.execute('SELECT count(*) FROM match_set')
+        print('{} sets'.format(c.fetchone()[0]))
+        d.conn.close()
+
+def bench_stats(args):
+    """Set-level stats for a player list, unfiltered and filtered"""
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        print('Building synthetic database with {} matches...'.format(
+            args.matches))
+        d = synthetic_db(os.path.join(tmp, 'bench.db'), args.matches)
+        c = d.conn.cursor()
+        c.executemany('UPDATE match SET score=? WHERE rowid=?', 
+                [(random_score(), i + 1) for i in range(args.matches)])
+        d.rebuild_match_set(c)
+        d.conn.commit()
+
+        pids = list(range(1, args.players + 1))
+        for label, start, end, surface in (('', None, None, None),
+                (' 2000-2004', '2000', '2004', None),
+                (' on clay', None, None, 'Clay')):
+            timed('set stats x{}{}'.format(len(pids), label),
+                    lambda: d.set_stats(pids, start, end, surface), 
+                    args.repeat)
+            if surface is None:
+                timed('records x{}{}'.format(len(pids), label),
+                        lambda: d.records(pids, start, end), args.repeat)
+        d.conn.close()
+
+def bench_parse(args):
+    """Tokenizer throughput over a corpus of saved .txt drawsheets"""
+    import drawsheet
+
+    files = []
+    for path in args.corpus:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files += [os.path.join(root, n) for n in sorted(names)
+                        if n.endswith('.txt')]
+        else:
+            files += [path]
+
+    texts = []
+    for filename in files:
+        f = open(filename)
+        texts += [f.read()]
+        f.close()
+
+    lines = sum(t.count('\n') + 1 for t in texts)
+    tokens = 0
+    start = time.perf_counter()
+    for i in range(args.repeat):
+        for t in texts:
+            data, width = drawsheet.drawsheet_parse(t)
+            tokens += sum(len(v) for v in data.values())
+    elapsed = time.perf_counter() - start
+
+    lines *= args.repeat
+    print('{} files, {} lines, {} tokens in {:.3f} s'.
+            format(len(files), lines, tokens, elapsed))
+    print('{:.0f} lines/sec, {:.0f} tokens/sec'.
+            format(lines / elapsed, tokens / elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='Benchmark tennis-datafier')
+    sub = parser.add_subparsers(dest='bench')
+
+    p = sub.add_parser('index',
+            help='query times before and after the index migration')
+    p.add_argument('-n', '--matches', type=int, default=1000000,
+            help='size of the synthetic database (default 1000000)')
+    p.set_defaults(func=bench_indexes)
+
+    p = sub.add_parser('dates',
+            help='dated queries with and without the statement cache')
+    p.add_argument('-n', '--matches', type=int, default=100000,
+            help='size of the synthetic database (default 100000)')
+    p.add_argument('-r', '--repeat', type=int, default=5,
+            help='timing runs (default 5)')
+    p.set_defaults(func=bench_dates)
+
+    p = sub.add_parser('startup',
+            help='import times and cold-start query runs of the CLI')
+    p.add_argument('-r', '--repeat', type=int, default=10,
+            help='runs, the best is reported (default 10)')
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser('text',
+            help='text-data parser throughput, alone and loading a db')
+    p.add_argument('files', metavar='FILE', nargs='*',
+            help='text-data files (default is a synthetic one)')
+    p.add_argument('-n', '--matches', type=int, default=200000,
+            help='size of the synthetic file (default 200000)')
+    p.add_argument('-j', '--jobs', metavar='N', type=int, action='append',
+            default=[], help='also load with N parsing processes, '
+                '0 for one per core (repeatable)')
+    p.set_defaults(func=bench_text)
+
+    p = sub.add_parser('elo',
+            help='full and incremental elo rating updates')
+    p.add_argument('-n', '--matches', type=int, default=200000,
+            help='size of the synthetic database (default 200000)')
+    p.set_defaults(func=bench_elo)
+
+    p = sub.add_parser('snapshot',
+            help='numpy snapshot queries against sqlite (requires numpy)')
+    p.add_argument('-n', '--matches', type=int, default=200000,
+            help='size of the synthetic database (default 200000)')
+    p.add_argument('-p', '--players', type=int, default=500,
+            help='players to query (default 500)')
+    p.add_argument('-r', '--repeat', type=int, default=5,
+            help='timing runs (default 5)')
+    p.set_defaults(func=bench_snapshot)
+
+    p = sub.add_parser('parquet',
+            help='Parquet archive export and import (requires pyarrow)')
+    p.add_argument('-n', '--matches', type=int, default=200000,
+            help='size of the synthetic database (default 200000)')
+    p.set_defaults(func=bench_parquet)
+
+    p = sub.add_parser('names',
+            help='player name resolution with the in-memory resolver')
+    p.add_argument('-p', '--players', type=int, default=100000,
+            help='players in the synthetic database (default 100000)')
+    p.add_argument('-r', '--repeat', type=int, default=5,
+            help='timing runs (default 5)')
+    p.set_defaults(func=bench_names)
+
+    p = sub.add_parser('scores',
+            help='score parsing and the match_set table')
+    p.add_argument('-s', '--scores', type=int, default=100000,
+            help='random scores to parse (default 100000)')
+    p.add_argument('-n', '--matches', type=int, default=200000,
+            help='size of the synthetic database (default 200000)')
+    p.set_defaults(func=bench_scores)
+
+    p = sub.add_parser('stats',
+            help='set-level stats queries against plain records')
+    p.add_argument('-n', '--matches', type=int, default=200000,
+            help='size of the synthetic database (default 200000)')
+    p.add_argument('-p', '--players', type=int, default=500,
+            help='players to query (default 500)')
+    p.add_argument('-r', '--repeat', type=int, default=5,
+            help='timing runs (default 5)')
+    p.set_defaults(func=bench_stats)
+
+    p = sub.add_parser('parse',
+            help='drawsheet_parse throughput over saved .txt drawsheets')
+    p.add_argument('corpus', metavar='PATH', nargs='+',
+            help='.txt drawsheets, or directories of them')
+    p.add_argument('-r', '--repeat', type=int, default=10,
+            help='passes over the corpus (default 10)')
+    p.set_defaults(func=bench_parse)
+
+    args = parser.parse_args()
+    if not args.bench:
+        parser.print_help()
+    else:
+        args.func(args)
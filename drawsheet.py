@@ -7,8 +7,10 @@ be on path for the drawsheet importer to function.
 """
 
 import re
+import os
+import json
+import hashlib
 import subprocess
-import readline
 import math
 import pprint
 import logging
@@ -17,6 +19,105 @@ import logging
 # Utility Functions            #
 ################################
 
+class SpatialIndex:
+    """
+    Grid-bucket index over drawsheet atoms, for nearest-neighbour 
+    lookups with deletion.
+
+    Atoms are (value, (x, y)) tuples. x is divided by xscale, and the
+    distance functions passed to nearest() must be at least the
+    euclidean distance on that scaled grid; all of the distances in this
+    module (which weigh a column less than a line) are.
+    """
+    def __init__(self, atoms, xscale, cell=4):
+        self.xscale = xscale
+        self.cell = cell
+        self.atoms = {}
+        self.buckets = {}
+        self.bounds = None
+        for seq, atom in enumerate(atoms):
+            self.atoms[seq] = atom
+            key = self.key(atom[1])
+            if key not in self.buckets:
+                self.buckets[key] = []
+            self.buckets[key] += [seq]
+
+            if self.bounds is None:
+                self.bounds = key + key
+            else:
+                x1, y1, x2, y2 = self.bounds
+                self.bounds = (min(x1, key[0]), min(y1, key[1]),
+                        max(x2, key[0]), max(y2, key[1]))
+
+    def __len__(self):
+        return len(self.atoms)
+
+    def key(self, point):
+        x, y = point
+        return (int(x / self.xscale // self.cell), int(y // self.cell))
+
+    def ring(self, cx, cy, r):
+        """cells at chebyshev distance r from (cx, cy)"""
+        if r == 0:
+            return [(cx, cy)]
+        cells = []
+        for x in range(cx - r, cx + r + 1):
+            cells += [(x, cy - r), (x, cy + r)]
+        for y in range(cy - r + 1, cy + r):
+            cells += [(cx - r, y), (cx + r, y)]
+        return cells
+
+    def nearest(self, point, distance):
+        """
+        Return the seq of the atom closest to point by 
+        distance(atom_position, point), or None if the index is empty.
+        Ties go to the atom that was added first.
+        """
+        if not self.atoms:
+            return None
+
+        cx, cy = self.key(point)
+        x1, y1, x2, y2 = self.bounds
+        best = None
+        r = 0
+        while True:
+            for cell in self.ring(cx, cy, r):
+                for seq in self.buckets.get(cell, ()):
+                    d = (distance(self.atoms[seq][1], point), seq)
+                    if best is None or d < best:
+                        best = d
+
+            # anything outside ring r is further than r cells away
+            if best is not None and best[0] <= r * self.cell:
+                break
+            if (cx - r <= x1 and cy - r <= y1 
+                    and cx + r >= x2 and cy + r >= y2):
+                break
+            r += 1
+
+        return best[1]
+
+    def get(self, seq):
+        return self.atoms[seq]
+
+    def remove(self, seq):
+        atom = self.atoms.pop(seq)
+        self.buckets[self.key(atom[1])].remove(seq)
+        return atom
+
+    def pop_nearest(self, point, distance):
+        """Remove and return the atom closest to point, or None"""
+        seq = self.nearest(point, distance)
+        if seq is None:
+            return None
+        return self.remove(seq)
+
+    def items(self):
+        """the remaining atoms, in the order they were added"""
+        return [self.atoms[seq] for seq in sorted(self.atoms)]
+
+
+
 RE_MONTHS = [r'Jan(\.|uary)?', 
           r'Feb(\.|ruary)?', 
           r'Mar(\.|ch)?',
@@ -58,20 +159,63 @@ def month_to_int(month):
     return None
 
 n_month = r"(?P<month>{})".format('|'.join(RE_MONTHS))
-date_re = (
-        re.compile(r"(?P<day>\d{1,2})(th)? ?- ?\d{1,2}(th)? " + 
-            n_month + r",? (?P<year>\d{4})"), 
-        re.compile(n_month + 
-            r" (?P<day>\d{1,2})(th)? ?- ?\d{1,2}(th)?,? (?P<year>\d{4})"), 
-        re.compile(r"(?P<year>\d{4})(?P<month>)(?P<day>)"),
-            )
-"""3 regexs for matching dates"""
+date_re = None
+"""3 regexs for matching dates, compiled by date_regexes() on first use"""
+
+def date_regexes():
+    global date_re
+    if date_re == None:
+        date_re = (
+            re.compile(r"(?P<day>\d{1,2})(th)? ?- ?\d{1,2}(th)? " + 
+                n_month + r",? (?P<year>\d{4})"), 
+            re.compile(n_month + 
+                r" (?P<day>\d{1,2})(th)? ?- ?\d{1,2}(th)?,? (?P<year>\d{4})"), 
+            re.compile(r"(?P<year>\d{4})(?P<month>)(?P<day>)"),
+                )
+    return date_re
+
+u_month = "({})".format('|'.join(RE_MONTHS))
+TOKENS = (
+        ('surface', r"Hard|Outdoor Hard|Red Clay|Green Clay|Clay|"
+                  r"Grass|Indoor Hard|Carpet|Indoor Carpet"),
+        ('date', r"\d{1,2}(th)? ?- ?\d{1,2}(th)? " + u_month + r",? \d{4}|" +
+                 u_month + r" \d{1,2}(th)? ?- ?\d{1,2}(th)?,? \d{4}"),
+        ('year', r"\d{4}"),
+        ('seed', r"(?<=\[)\d+(?=\])|(?<=\[ )\d+(?=\ ])"),
+        ('round', r"(1st|2nd|3rd) Round|1/8|1/4|1/2"),
+        ('class', r"WTA( [A-Za-z0-9]+)*|US Open|"
+                  r"French Open|Australian Open|Wimbledon"),
+        ('orderedname', r"[A-Z][a-z]+(( |-)[A-Z][a-z]+)*"
+                        r" ([A-Z]+(( |-)[A-Z]+)*)(?= |$)"),
+        ('fullname', r"(?:^| )[Bb][Yy][Ee](?:$| )|([A-Z]+(( |-)[A-Z]+)*,\s"
+                          r"[A-Z][a-zA-Z]*(( |-)([A-Z][a-zA-Z]*[a-z]))*)"),
+        #('shortname', r"[A-Z]\. ?[A-Z]+(( |-)[A-Z]+)*"),
+        ('shortname', r"[A-Z]\. ?[A-Za-z]+(( |-)[A-Za-z]+)*"),
+        ('country', r"(?:(?!RET)[A-Z]{3}|\([A-Z]{3}\))(?= |$)"),
+        ('score',
+             r"([0-7][/-]?[0-7](\(\d+\))?)( [0-7][/-]?[0-7](\(\d+\))?){0,2}"
+             r" ([Rr]et\.|[Rr]et'd|[Rr]etired|[Rr]et)"
+             r"|([0-7][/-]?[0-7](\(\d+\))?)( [0-7][/-]?[0-7](\(\d+\))?){1,2}"
+             r"|([0-7]/?[0-7](\(\d+\))? ){2}[\d+]/[\d+]"
+             r"|(wo.|[Ww]alkover)"),
+        ('prize', r"\$[0-9,]+(?= |$)"),
+        ('number', r"\d{1,3}\.?(?= |$)"),
+        ('city', r"[A-Z][A-Za-z]*( [A-Z][A-Za-z]+)*,"
+                    r"( [A-Z][A-Z],)? (USA|[A-Z][a-z]*)"),
+        ('status', r"(^|(?<=\[|\(| ))(Q|LL|W|WC)((?=\]|\)| )|$)"),
+        ('string', r"([A-Za-z&,\']+)( [A-Z&a-z$,]+)*"),
+        )
+"""drawsheet token types and their regexs, tried in order"""
+
+TOKEN_RE = re.compile('|'.join(["(?P<{}>{})".format(k, v) 
+    for k, v in TOKENS]))
+"""single-pass tokenizer; the token type is the match's lastgroup"""
 
 def normalize_dates(dates):
     """Takes a date string and output it as YYYY-MM-DD"""
     n_dates = []
     for date, pos in dates:
-        for r in date_re:
+        for r in date_regexes():
             m = r.match(date)
             if m:
                 d = m.groupdict()
@@ -89,23 +233,100 @@ def normalize_dates(dates):
     n_dates.sort(key=lambda d: len(d), reverse=True)
     return n_dates
 
-def process_pdf(filename, qualies_only=False):
+CACHE_DIR = os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+        'tennis-datafier', 'pdftotext')
+"""where extracted drawsheet text is cached"""
+
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+"""the cache is trimmed, least recently used first, to this size"""
+
+def cache_get(key):
     """
-    Parse the pdf file in filename.
+    Return the cached text for key, or None
+    """
+    path = os.path.join(CACHE_DIR, key + '.txt')
+    try:
+        f = open(path, encoding='utf-8')
+        text = f.read()
+        f.close()
+        # the mtime is the LRU clock
+        os.utime(path)
+    except OSError:
+        return None
 
-    Retuns a tuple (main_draw, qualifying_draw) where each component is:
-        (draw, status, meta).
+    logging.debug("pdftotext cache hit: {}".format(key))
+    return text
+
+def cache_put(key, text):
+    """
+    Store text under key, then evict the least recently used entries
+    until the cache fits in CACHE_MAX_BYTES
+    """
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = os.path.join(CACHE_DIR, key + '.txt')
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        f = open(tmp, 'w', encoding='utf-8')
+        f.write(text)
+        f.close()
+        os.replace(tmp, path)
+
+        entries = []
+        for e in os.scandir(CACHE_DIR):
+            if e.name.endswith('.txt'):
+                st = e.stat()
+                entries += [(st.st_mtime, st.st_size, e.path)]
+    except OSError as e:
+        logging.warning("pdftotext cache: {}".format(e))
+        return
+
+    total = sum(size for mtime, size, p in entries)
+    for mtime, size, p in sorted(entries):
+        if total <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+        total -= size
+
+def pdf_text(filename, use_cache=True):
+    """
+    Return the layout text of a drawsheet; .txt files are read as-is,
+    anything else is run through pdftotext.
+
+    pdftotext output is cached by the SHA-256 of the pdf unless 
+    use_cache is False.
     """
     if filename.endswith('.txt'):
         f = open(filename)
         text = f.read()
         f.close()
-    else:
-        text = subprocess.check_output(["pdftotext", "-layout",
-            filename, "-"]).decode('utf-8')
+        return text
 
-    print("Processing {}...".format(filename))
+    key = None
+    if use_cache:
+        f = open(filename, 'rb')
+        key = hashlib.sha256(f.read()).hexdigest()
+        f.close()
+
+        text = cache_get(key)
+        if text is not None:
+            return text
+
+    text = subprocess.check_output(["pdftotext", "-layout",
+        filename, "-"]).decode('utf-8')
+
+    if key:
+        cache_put(key, text)
+
+    return text
 
+def split_pages(text):
+    """
+    Split drawsheet text into (main_draw_pages, qualifying_pages)
+    """
     pages = text.split(chr(12))
     print ("{} Pages".format(len(pages)))
     md = []
@@ -120,6 +341,21 @@ def process_pdf(filename, qualies_only=False):
         elif ('Qualifiers' in p and not 'Doubles' in p):
             qd += [p]
 
+    return md, qd
+
+def process_pdf(filename, qualies_only=False, use_cache=True):
+    """
+    Parse the pdf file in filename.
+
+    Retuns a tuple (main_draw, qualifying_draw) where each component is:
+        (draw, status, meta).
+    """
+    text = pdf_text(filename, use_cache)
+
+    print("Processing {}...".format(filename))
+
+    md, qd = split_pages(text)
+
     md_result = None
     qd_result = None
 
@@ -134,6 +370,121 @@ def process_pdf(filename, qualies_only=False):
 
     return (md_result, qd_result)
 
+def sidecar_path(filename):
+    """
+    The metadata sidecar next to filename (foo.pdf -> foo.json, foo.yaml
+    or foo.yml), or None
+    """
+    base = os.path.splitext(filename)[0]
+    for ext in ('.json', '.yaml', '.yml'):
+        if os.path.exists(base + ext):
+            return base + ext
+
+    return None
+
+def load_overrides(filename):
+    """
+    Load tourney metadata overrides from the sidecar file next to 
+    filename.
+
+    Returns a dict keyed like the meta dict, or None if there's no sidecar.
+    """
+    path = sidecar_path(filename)
+    if path != None:
+        ext = os.path.splitext(path)[1]
+        f = open(path)
+        try:
+            if ext == '.json':
+                overrides = json.load(f)
+            else:
+                try:
+                    import yaml
+                except ImportError:
+                    raise RuntimeError('{}: PyYAML is required to read '
+                            'YAML overrides'.format(path))
+                overrides = yaml.safe_load(f)
+        finally:
+            f.close()
+
+        return {k.capitalize(): str(v) 
+                for k, v in (overrides or {}).items()}
+
+    return None
+
+def write_report(filename, report):
+    """
+    Write a headless import report next to filename (foo.report.json)
+    """
+    path = os.path.splitext(filename)[0] + '.report.json'
+    f = open(path, 'w')
+    json.dump(report, f, indent=2, sort_keys=True)
+    f.close()
+
+def process_pdf_headless(filename, qualies_only=False, use_cache=True):
+    """
+    Parse the pdf file in filename without any user interaction.
+
+    Metadata is the best guess from drawsheet_auto_meta, overridden by
+    the sidecar file if there is one, and a confidence report is written
+    next to the file. Safe to run in a worker process. 
+
+    Returns the same tuple as process_pdf, with None for any draw that 
+    failed to parse.
+    """
+    overrides = load_overrides(filename)
+    text = pdf_text(filename, use_cache)
+
+    print("Processing {}...".format(filename))
+
+    md, qd = split_pages(text)
+
+    md_result = None
+    qd_result = None
+    report = {
+            'file': filename,
+            'overrides': overrides,
+            }
+
+    meta = None
+    confidence = {}
+    if md and not qualies_only:
+        built = drawsheet_build(chr(12).join(md))
+        if built:
+            draw, status, data = built
+            meta, confidence = drawsheet_auto_meta(data, overrides)
+            md_result = (draw, status, meta)
+            report['main'] = drawsheet_draw_report(draw, status)
+        else:
+            report['main'] = None
+
+    if qd:
+        built = drawsheet_build(chr(12).join(qd), True)
+        if built:
+            draw, status, data = built
+            if not meta:
+                meta, confidence = drawsheet_auto_meta(data, overrides)
+            qd_result = (draw, status, meta)
+            report['qualifying'] = drawsheet_draw_report(draw, status)
+        else:
+            report['qualifying'] = None
+
+    # the import is only as good as its weakest part
+    scores = list(confidence.values())
+    for k in ('main', 'qualifying'):
+        if k in report:
+            scores += [report[k]['complete'] if report[k] else 0.0]
+
+    report['meta'] = meta
+    report['meta_confidence'] = confidence
+    report['confidence'] = min(scores) if scores else 0.0
+    report['review'] = sorted(k for k, v in confidence.items() if v < 0.5)
+    write_report(filename, report)
+
+    print("{}: confidence {:.2f}{}".format(filename, report['confidence'],
+        ', check ' + ', '.join(report['review']) if report['review'] else ''))
+
+    return (md_result, qd_result)
+
 
 def drawsheet_parse(text):
     """
@@ -141,42 +492,7 @@ def drawsheet_parse(text):
     """
     logging.debug("################ PARSING DRAW ##################")
 
-    month = "({})".format('|'.join(RE_MONTHS))
-
-    patterns = (
-            ('surface', r"Hard|Outdoor Hard|Red Clay|Green Clay|Clay|"
-                      r"Grass|Indoor Hard|Carpet|Indoor Carpet"),
-            ('date', r"\d{1,2}(th)? ?- ?\d{1,2}(th)? " + month + r",? \d{4}|" +
-                     month + r" \d{1,2}(th)? ?- ?\d{1,2}(th)?,? \d{4}"),
-            ('year', r"\d{4}"),
-            ('seed', r"(?<=\[)\d+(?=\])|(?<=\[ )\d+(?=\ ])"),
-            ('round', r"(1st|2nd|3rd) Round|1/8|1/4|1/2"),
-            ('class', r"WTA( [A-Za-z0-9]+)*|US Open|"
-                      r"French Open|Australian Open|Wimbledon"),
-            ('orderedname', r"[A-Z][a-z]+(( |-)[A-Z][a-z]+)*"
-                            r" ([A-Z]+(( |-)[A-Z]+)*)(?= |$)"),
-            ('fullname', r"(?:^| )[Bb][Yy][Ee](?:$| )|([A-Z]+(( |-)[A-Z]+)*,\s"
-                              r"[A-Z][a-zA-Z]*(( |-)([A-Z][a-zA-Z]*[a-z]))*)"),
-            #('shortname', r"[A-Z]\. ?[A-Z]+(( |-)[A-Z]+)*"),
-            ('shortname', r"[A-Z]\. ?[A-Za-z]+(( |-)[A-Za-z]+)*"),
-            ('country', r"(?:(?!RET)[A-Z]{3}|\([A-Z]{3}\))(?= |$)"),
-            ('score',
-                 r"([0-7][/-]?[0-7](\(\d+\))?)( [0-7][/-]?[0-7](\(\d+\))?){0,2}"
-                 r" ([Rr]et\.|[Rr]et'd|[Rr]etired|[Rr]et)"
-                 r"|([0-7][/-]?[0-7](\(\d+\))?)( [0-7][/-]?[0-7](\(\d+\))?){1,2}"
-                 r"|([0-7]/?[0-7](\(\d+\))? ){2}[\d+]/[\d+]"
-                 r"|(wo.|[Ww]alkover)"),
-            ('prize', r"\$[0-9,]+(?= |$)"),
-            ('number', r"\d{1,3}\.?(?= |$)"),
-            ('city', r"[A-Z][A-Za-z]*( [A-Z][A-Za-z]+)*,"
-                        r"( [A-Z][A-Z],)? (USA|[A-Z][a-z]*)"),
-            ('status', r"(^|(?<=\[|\(| ))(Q|LL|W|WC)((?=\]|\)| )|$)"),
-            ('string', r"([A-Za-z&,\']+)( [A-Z&a-z$,]+)*"),
-            )
-    
-    pattern = re.compile('|'.join(["(?P<{}>{})".format(k, v) 
-        for k, v in patterns]))
-    data = { k: [] for k, v in patterns}
+    data = { k: [] for k, v in TOKENS}
 
     short_to_fullnames = {}
     ordered_to_fullnames = {}
@@ -213,20 +529,19 @@ def drawsheet_parse(text):
             skipping_page = True
             continue;
 
-        for m in pattern.finditer(line):
-            for group, match in m.groupdict().items():
-                if match is not None:
-                    match = match.strip()
-                    x1 = m.start(group)
-                    x2 = m.end(group)
+        for m in TOKEN_RE.finditer(line):
+            # exactly one token group matches, and it closes last
+            group = m.lastgroup
+            match = m.group(group).strip()
+            x1, x2 = m.span(group)
 
-                    if x2 > width:
-                        width = x2
+            if x2 > width:
+                width = x2
 
-                    data[group] += [(match, ((x1, x2), y))]
+            data[group] += [(match, ((x1, x2), y))]
 
-                    if group == 'fullname' and match.upper() != "BYE":
-                        add_to_fullname_conversion_table(match, (x1, x2), y)
+            if group == 'fullname' and match.upper() != "BYE":
+                add_to_fullname_conversion_table(match, (x1, x2), y)
 
         y += 1
 
@@ -309,7 +624,8 @@ def drawsheet_parse(text):
 
     data['shortname'] = shortnames
 
-    logging.debug(pprint.pformat(data))
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(pprint.pformat(data))
 
     return data, width;
 
@@ -322,6 +638,8 @@ def drawsheet_complete_draw(draw, wins, scores):
 
     logging.debug("################ PROCESSING DRAW ###############")
 
+    score_index = SpatialIndex(scores, 5)
+
     while len(wins) > 0 and len(draw[-1]) != 1:
         
         if len(draw[-1]) < 2:
@@ -369,7 +687,7 @@ def drawsheet_complete_draw(draw, wins, scores):
             if prev_a[0].upper() == "BYE" or prev_b[0].upper() == "BYE":
                 score = 'bye'
             else:
-                score = drawsheet_get_score(winner, scores)
+                score = drawsheet_get_score(winner, score_index)
 
             logging.debug("\t\tWINNER {} ({})".format(winner[0], score))
 
@@ -383,9 +701,13 @@ def drawsheet_complete_draw(draw, wins, scores):
 
         draw += [rnd]
 
+    # hand the unused scores back
+    scores[:] = score_index.items()
+
 def drawsheet_get_score(player, scores):
     """
-    Find the score closest to a given player
+    Find and remove the score closest to a given player from the 
+    SpatialIndex scores
     """
     def distance(score, player):
         dx = float(score[0] - player[0]) / 5
@@ -395,58 +717,17 @@ def drawsheet_get_score(player, scores):
 
         return math.sqrt(dx * dx + dy * dy)
 
-    if len(scores) == 0:
+    score = scores.pop_nearest(player[1], distance)
+    if score is None:
         return None
 
-    scores.sort(key=lambda s: distance(s[1], player[1]))
-    #print([(k, distance(k[1], player[1])) for k in scores[:3]])
-    score = scores[0]
-    del scores[0]
-
     return score[0]
 
-def drawsheet_get_all_meta(data):
+def drawsheet_meta_candidates(data):
     """
-    Try to parse the tourney metadata and prompt the user for 
-    correctness.
+    Collect the candidates for each piece of tourney metadata, best
+    guess first
     """
-    def get_meta(prompt, default, default_list):
-        default_count = 0
-        if default_list:
-            if not default:
-                count = len(default_list)
-                if count == 0:
-                    default = ''
-                else:
-                    if type(default_list[0]) is str:
-                        default = default_list[0]
-                    else:
-                        default = default_list[0][0]
-                    default_count = count - 1
-
-            readline.clear_history()
-            default_list.reverse()
-            for d in default_list:
-                if type(d) is str:
-                    readline.add_history(d)
-                else:
-                    readline.add_history(d[0])
-
-        if default_count > 0:
-            full_prompt = ('{} [{}](+ {} more): '.
-                    format(prompt, default, default_count))
-        else:
-            full_prompt = ('{} [{}]: '.
-                    format(prompt, default))
-
-        result = input(full_prompt)
-        if result == '':
-            return default
-        else:
-            return result
-
-    meta = dict.fromkeys((
-        'Name', 'Class', 'City', 'Country', 'Surface', 'Date'))
     dates = normalize_dates(data['date'] + data['year'])
 
     names = data['string']
@@ -493,6 +774,91 @@ def drawsheet_get_all_meta(data):
             else:
                 classes += [c]
 
+    return {
+            'Name': names,
+            'Class': classes,
+            'Date': dates,
+            'City': cities,
+            'Country': countries,
+            'Surface': surface,
+            }
+
+def drawsheet_auto_meta(data, overrides=None):
+    """
+    Pick the best guess for each piece of tourney metadata without
+    prompting, letting overrides win.
+
+    returns (meta, confidence), where confidence maps each key to the 
+    share of candidates agreeing with the pick (1.0 for an override)
+    """
+    meta = {}
+    confidence = {}
+    for k, candidates in drawsheet_meta_candidates(data).items():
+        values = [c if type(c) is str else c[0] for c in candidates]
+        if overrides and k in overrides:
+            meta[k] = overrides[k]
+            confidence[k] = 1.0
+        elif len(values) == 0:
+            meta[k] = ''
+            confidence[k] = 0.0
+        else:
+            meta[k] = values[0]
+            confidence[k] = values.count(values[0]) / len(values)
+
+    return meta, confidence
+
+def drawsheet_get_all_meta(data):
+    """
+    Try to parse the tourney metadata and prompt the user for 
+    correctness.
+    """
+    import readline
+
+    def get_meta(prompt, default, default_list):
+        default_count = 0
+        if default_list:
+            if not default:
+                count = len(default_list)
+                if count == 0:
+                    default = ''
+                else:
+                    if type(default_list[0]) is str:
+                        default = default_list[0]
+                    else:
+                        default = default_list[0][0]
+                    default_count = count - 1
+
+            readline.clear_history()
+            default_list.reverse()
+            for d in default_list:
+                if type(d) is str:
+                    readline.add_history(d)
+                else:
+                    readline.add_history(d[0])
+
+        if default_count > 0:
+            full_prompt = ('{} [{}](+ {} more): '.
+                    format(prompt, default, default_count))
+        else:
+            full_prompt = ('{} [{}]: '.
+                    format(prompt, default))
+
+        result = input(full_prompt)
+        if result == '':
+            return default
+        else:
+            return result
+
+    meta = dict.fromkeys((
+        'Name', 'Class', 'City', 'Country', 'Surface', 'Date'))
+    candidates = drawsheet_meta_candidates(data)
+    names = candidates['Name']
+    classes = candidates['Class']
+    dates = candidates['Date']
+    cities = candidates['City']
+    countries = candidates['Country']
+    surface = candidates['Surface']
+
     all_correct = 'n'
     while all_correct in ('N', 'n'):
         print()
@@ -535,11 +901,12 @@ def drawsheet_players_status(draw, data):
         return math.sqrt(dx * dx + dy * dy)
 
     # 1. Discard draw position for each player
-    numbers = data['number']
+    number_index = SpatialIndex(data['number'], 10)
     for p in draw[0]:
-        numbers.sort(key=lambda n: distance(n[1], p[1]))
-        logging.debug("Discarding draw pos: {} - {}".format(numbers[0], p))
-        del numbers[0]
+        number = number_index.pop_nearest(p[1], distance)
+        logging.debug("Discarding draw pos: {} - {}".format(number, p))
+    numbers = data['number']
+    numbers[:] = number_index.items()
 
     
     # 2. Find players for seeding or Q or WC or LL status
@@ -562,6 +929,7 @@ def drawsheet_players_status(draw, data):
             if name != "BYE"}
 
     players_flat = [p for l in draw for p in l if p[0] != "BYE"]
+    player_index = SpatialIndex(players_flat, 20)
 
     # for each seed, find the matching player and vote
     last_seed = 0
@@ -569,7 +937,7 @@ def drawsheet_players_status(draw, data):
 
         candidates = {}
         for pos in poslist:
-            player = min(players_flat, key=lambda p: distance2(pos, p[1]))
+            player = player_index.get(player_index.nearest(pos, distance2))
             if player[0] in candidates:
                 candidates[player[0]] += 1
             else:
@@ -581,9 +949,10 @@ def drawsheet_players_status(draw, data):
     # 2b. assign other status
 
     players_flat = [p for p in draw[0] if p[0] != "BYE"]
+    player_index = SpatialIndex(players_flat, 20)
     for s, pos in data['status']:
         #players_flat.sort(key=lambda p: distance(pos, p[1]))
-        p, pos = min(players_flat, key=lambda p: distance2(pos, p[1]))
+        p, pos = player_index.get(player_index.nearest(pos, distance2))
         old_s, c = status[p]
         if old_s == None:
             status[p] = (s, c)
@@ -596,12 +965,30 @@ def drawsheet_players_status(draw, data):
                 #break
 
     # 3. Find country for each player
+    player_index = SpatialIndex(players_flat, 10)
     for c, pos in data['country']:
-        player = min(players_flat, key=lambda p: distance(pos, p[1]))[0]
+        player = player_index.get(player_index.nearest(pos, distance))[0]
         status[player] = (status[player][0], c)
 
     return status
 
+def drawsheet_draw_report(draw, status):
+    """
+    Summarize how much of a processed draw was recovered
+    """
+    matches = [m for rnd in draw[1:] for m in rnd]
+    expected = len(draw[0]) - 1
+
+    return {
+            'players': len(status),
+            'matches': len(matches),
+            'expected_matches': expected,
+            'missing_scores': len([m for m in matches if m[2] is None]),
+            'missing_countries': len([s for s in status.values() 
+                if s[1] is None]),
+            'complete': min(1.0, len(matches) / expected) if expected else 0.0,
+            }
+
 def drawsheet_print_draw(draw, status):
     """
     Return a human readable representation of the drawsheet
@@ -654,10 +1041,11 @@ def drawsheet_print_draw(draw, status):
     return '\n'.join(output)
 
 
-def drawsheet_process(text, meta = None, qualifying = False):
+def drawsheet_build(text, qualifying = False):
     """
-    Parse and process a drawsheet
-    returns (draw, status, meta)
+    Parse a drawsheet and work out the draw and player status, without
+    any user interaction
+    returns (draw, status, data), or None if the draw couldn't be found
     """
     data, width = drawsheet_parse(text)
 
@@ -790,6 +1178,19 @@ def drawsheet_process(text, meta = None, qualifying = False):
     logging.debug("######## STATUS ########")
     logging.debug(pprint.pformat(status))
 
+    return (draw, status, data)
+
+def drawsheet_process(text, meta = None, qualifying = False):
+    """
+    Parse and process a drawsheet
+    returns (draw, status, meta)
+    """
+    built = drawsheet_build(text, qualifying)
+    if not built:
+        return
+
+    draw, status, data = built
+
     # Ask the user to confirm the data
     
     if qualifying:
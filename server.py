@@ -0,0 +1,232 @@
+"""
+server - a local HTTP JSON API over a tennis-datafier database
+
+Keeps one open connection, so requests skip the imports, migration check
+and statement compiling that every command line run pays for, and keeps
+the results of recent queries until the database changes.
+
+Every endpoint takes GET parameters and returns JSON:
+
+    /players?name=NAME
+    /record?player=NAME[&player=NAME...][&start=DATE][&end=DATE]
+    /matches?player=NAME[&n=N][&start=DATE][&end=DATE]
+    /best, /worst, /rivals?player=NAME[&n=N][&start=DATE][&end=DATE]
+    /undefeated?player=NAME[&start=DATE][&end=DATE]
+    /h2h?player=NAME&player=NAME[...][&start=DATE][&end=DATE]
+    /ratings?player=NAME[&player=NAME...][&end=DATE]
+    /stats?player=NAME[&player=NAME...][&start=DATE][&end=DATE]
+        [&surface=SURFACE]
+
+player takes the same names as the command line. Dates are YYYY,
+YYYY-MM or YYYY-MM-DD.
+"""
+
+import collections
+import http.server
+import json
+import logging
+import urllib.parse
+
+import tennis_datafier
+
+class result_cache:
+    """
+    LRU cache of query results, emptied whenever the database changes
+    """
+    def __init__(self, d, size):
+        self.d = d
+        self.size = size
+        self.results = collections.OrderedDict()
+        self.version = None
+
+    def check(self):
+        """Drop everything if another connection has committed"""
+        version = self.d.conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self.version:
+            self.results.clear()
+            self.d.name_cache.clear()
+            self.d.players = None
+            self.version = version
+
+    def get(self, key, compute):
+        self.check()
+        if key in self.results:
+            self.results.move_to_end(key)
+            return self.results[key]
+
+        result = compute()
+        self.results[key] = result
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+        return result
+
+class query_server(http.server.HTTPServer):
+    """
+    HTTP server answering queries from a single db
+    """
+    CACHE_SIZE = 1000
+
+    def __init__(self, address, d):
+        super().__init__(address, query_handler)
+        self.d = d
+        self.cache = result_cache(d, self.CACHE_SIZE)
+        self.endpoints = {
+                '/players': self.players,
+                '/record': self.record,
+                '/matches': self.matches,
+                '/best': lambda q: self.best_worst(q, 'best'),
+                '/worst': lambda q: self.best_worst(q, 'worst'),
+                '/rivals': lambda q: self.best_worst(q, 'rivals'),
+                '/undefeated': self.undefeated,
+                '/h2h': self.h2h,
+                '/ratings': self.ratings,
+                '/stats': self.stats,
+                }
+
+    def query(self, path, query):
+        """
+        The JSON-ready result for an endpoint and its parsed parameters;
+        raises ValueError for bad parameters
+        """
+        endpoint = self.endpoints[path]
+        key = (path, tuple(sorted((k, tuple(v)) for k, v in query.items())))
+        return self.cache.get(key, lambda: endpoint(query))
+
+    def pids(self, query):
+        if 'player' not in query:
+            raise ValueError('player is required')
+
+        pids = []
+        for name in query['player']:
+            for p in self.d.get_pids(name, announce=False):
+                if p not in pids:
+                    pids += [p]
+        self.d.prefetch_names(pids)
+        return pids
+
+    def dates(self, query):
+        start = query.get('start', [None])[0]
+        end = query.get('end', [None])[0]
+        for date in (start, end):
+            if date:
+                tennis_datafier.parse_date(date)
+        return start, end
+
+    def player(self, p):
+        return {'p_id': p, 'name': self.d.namefl(p)}
+
+    def players(self, query):
+        if 'name' not in query:
+            raise ValueError('name is required')
+
+        pids = self.pids({'player': query['name']})
+        return [self.player(p) for p in pids]
+
+    def record(self, query):
+        pids = self.pids(query)
+        records = self.d.records(pids, *self.dates(query))
+        return [dict(self.player(p), record=records[p]) for p in pids]
+
+    def matches(self, query):
+        start, end = self.dates(query)
+        n = int(query.get('n', [0])[0]) or None
+        fields = ('date', 'city', 'class', 'round', 'winner',
+                'winner_status', 'loser', 'loser_status', 'score', 'surface')
+
+        results = []
+        for p in self.pids(query):
+            matches = []
+            for m in self.d.matches(p, n, start, end):
+                m = dict(zip(fields, m))
+                m['winner'] = self.player(m['winner'])
+                m['loser'] = self.player(m['loser'])
+                matches += [m]
+            results += [dict(self.player(p), matches=matches)]
+        return results
+
+    def best_worst(self, query, operation):
+        pids = self.pids(query)
+        n = int(query.get('n', [10])[0])
+        results = self.d.best_worst(pids, n, operation, *self.dates(query))
+        return [dict(self.player(p), opponents=[
+            dict(self.player(o), wins=w, losses=l)
+            for o, w, l in results[p]]) for p in pids]
+
+    def undefeated(self, query):
+        pids = self.pids(query)
+        undefeated = self.d.undefeated(pids, *self.dates(query))
+
+        results = []
+        for p in pids:
+            beaten, lost_to = undefeated[p]
+            self.d.prefetch_names(list(beaten) + list(lost_to))
+            results += [dict(self.player(p),
+                beaten=[dict(self.player(o), wins=n)
+                    for o, n in sorted(beaten.items(), key=lambda a: -a[1])],
+                lost_to=[dict(self.player(o), losses=n)
+                    for o, n in sorted(lost_to.items(), key=lambda a: -a[1])],
+                )]
+        return results
+
+    def h2h(self, query):
+        pids = self.pids(query)
+        try:
+            matrix = self.d.h2h_matrix(pids, *self.dates(query))
+        except ImportError:
+            raise ValueError('numpy is required for h2h')
+
+        return {
+                'players': [self.player(p) for p in pids],
+                'wins': matrix.tolist(),
+                }
+
+    def ratings(self, query):
+        pids = self.pids(query)
+        ratings = self.d.ratings(pids, self.dates(query)[1])
+        return [dict(self.player(p), ratings={
+            surface: {'rating': rating, 'matches': matches}
+            for surface, (rating, matches) in ratings[p].items()})
+            for p in pids]
+
+    def stats(self, query):
+        pids = self.pids(query)
+        surface = query.get('surface', [None])[0]
+        stats = self.d.set_stats(pids, *self.dates(query), surface=surface)
+        return [dict(self.player(p), stats=stats[p]._asdict()) 
+                for p in pids]
+
+class query_handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+
+        if url.path not in self.server.endpoints:
+            status, result = 404, {'error': 'no such endpoint: ' + url.path}
+        else:
+            try:
+                status, result = 200, self.server.query(url.path, query)
+            except ValueError as e:
+                status, result = 400, {'error': str(e)}
+
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+def serve(d, address):
+    """
+    Answer queries on address, a [HOST:]PORT string, until interrupted
+    """
+    host, sep, port = address.rpartition(':')
+    server = query_server((host or '127.0.0.1', int(port)), d)
+    print('Serving on http://{}:{}/'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
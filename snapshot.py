@@ -0,0 +1,164 @@
+"""
+snapshot - a columnar NumPy copy of a tennis-datafier database
+
+export() writes every match, with its tournament and the players'
+entries, as one .npy file per column in a directory:
+
+    t_id, day, winner, loser     int32, one row per match; loser is -1
+                                 for a bye, day -1 for an undated
+                                 tournament
+    surface, class, round,       int16 codes into the lists of the same
+    winner_status, loser_status  name in meta.json
+    games_w, games_l, tiebreak   int8, one column per set; -1 where the
+                                 set wasn't played or isn't a number
+
+snapshot() memory-maps them read-only, so loading costs nothing until
+a column is used, and answers records, splits and head-to-heads with
+vectorized masks over the whole archive. Requires numpy.
+"""
+
+import json
+import os
+
+import numpy as np
+
+import tennis_datafier
+
+CATEGORIES = ('surface', 'class', 'round', 'winner_status', 'loser_status')
+SETS = 3
+
+def export(d, directory):
+    """
+    Write db d's matches to directory as a snapshot; returns the number
+    of matches written
+    """
+    c = d.conn.cursor()
+    c.execute('SELECT m.t_id, coalesce(t.day, -1), m.winner, '
+            'coalesce(m.loser, -1), t.surface, t.class, m.round, '
+            'pw.status, pl.status, ' +
+            ', '.join(tennis_datafier.games_sql(
+                'm.score_{}_{}'.format(kind, i), -1)
+                for i in range(1, SETS + 1) for kind in ('w', 'l', 'tb')) + 
+            ' FROM match m INNER JOIN tournament t ON t.t_id=m.t_id '
+            'LEFT JOIN player_tournament pw '
+                'ON pw.t_id=m.t_id AND pw.p_id=m.winner '
+            'LEFT JOIN player_tournament pl '
+                'ON pl.t_id=m.t_id AND pl.p_id=m.loser '
+            'ORDER BY t.day, m.t_id')
+    rows = c.fetchall()
+    c.close()
+
+    columns = list(zip(*rows)) or [()] * (9 + 3 * SETS)
+    arrays = {}
+    for name, values in zip(('t_id', 'day', 'winner', 'loser'), columns):
+        arrays[name] = np.array(values, dtype=np.int32)
+
+    meta = {'matches': len(rows), 'sets': SETS,
+            'max_pid': int(max(arrays['winner'].max(initial=0),
+                arrays['loser'].max(initial=0)))}
+    for name, values in zip(CATEGORIES, columns[4:9]):
+        codes = {}
+        arrays[name] = np.array([codes.setdefault(v, len(codes))
+            for v in values], dtype=np.int16)
+        meta[name] = list(codes)
+
+    scores = np.array([row[9:] for row in rows],
+            dtype=np.int8).reshape(len(rows), SETS, 3)
+    arrays['games_w'] = np.ascontiguousarray(scores[:, :, 0])
+    arrays['games_l'] = np.ascontiguousarray(scores[:, :, 1])
+    arrays['tiebreak'] = np.ascontiguousarray(scores[:, :, 2])
+
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, name + '.npy'), array)
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    return len(rows)
+
+class snapshot:
+    """
+    A snapshot directory, memory-mapped
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+        for name in ('t_id', 'day', 'winner', 'loser', 'games_w',
+                'games_l', 'tiebreak') + CATEGORIES:
+            setattr(self, name, np.load(os.path.join(directory,
+                name + '.npy'), mmap_mode='r'))
+
+    def __len__(self):
+        return self.meta['matches']
+
+    def bins(self, pids):
+        """Bins needed to count by p_id for pids and every stored player"""
+        return max(self.meta['max_pid'], max(pids, default=0)) + 1
+
+    def mask(self, start=None, end=None, surface=None):
+        """
+        Boolean mask of played matches (no byes) between dates, and on a
+        surface if given
+        """
+        m = self.loser >= 0
+        if start or end:
+            lo = tennis_datafier.day_number(start) if start else 0
+            hi = (tennis_datafier.day_number(end, True) if end
+                    else np.iinfo(np.int32).max)
+            m &= (self.day >= lo) & (self.day <= hi)
+        if surface is not None:
+            if surface not in self.meta['surface']:
+                return np.zeros(len(self), dtype=bool)
+            m &= self.surface == self.meta['surface'].index(surface)
+        return m
+
+    def splits(self, pids, start=None, end=None):
+        """
+        Win/loss records by surface, like db.records:
+        {pid: {surface: (wins, losses)}}
+        """
+        m = self.mask(start, end)
+        surfaces = self.meta['surface']
+        n = len(surfaces)
+        size = self.bins(pids) * n
+
+        # one bin per (player, surface)
+        wins = np.bincount(self.winner[m] * n + self.surface[m],
+                minlength=size)
+        losses = np.bincount(self.loser[m] * n + self.surface[m],
+                minlength=size)
+
+        results = {}
+        for p in pids:
+            w, l = wins[p * n:(p + 1) * n], losses[p * n:(p + 1) * n]
+            results[p] = {surfaces[i]: (int(w[i]), int(l[i]))
+                    for i in np.flatnonzero(w + l)}
+        return results
+
+    def record(self, pids, start=None, end=None, surface=None):
+        """{pid: (wins, losses)}"""
+        m = self.mask(start, end, surface)
+        size = self.bins(pids)
+        wins = np.bincount(self.winner[m], minlength=size)
+        losses = np.bincount(self.loser[m], minlength=size)
+        return {p: (int(wins[p]), int(losses[p])) for p in pids}
+
+    def h2h(self, pids, start=None, end=None, surface=None):
+        """
+        N x N array where [i, j] is the number of times pids[i] beat
+        pids[j], like db.h2h_matrix
+        """
+        n = len(pids)
+        size = self.bins(pids)
+        position = np.full(size, -1, dtype=np.int64)
+        position[np.array(pids, dtype=np.int64)] = np.arange(n)
+
+        m = self.mask(start, end, surface)
+        wi = position[self.winner[m]]
+        li = position[self.loser[m]]
+        both = (wi >= 0) & (li >= 0)
+
+        matrix = np.zeros((n, n), dtype=np.int32)
+        np.add.at(matrix, (wi[both], li[both]), 1)
+        return matrix
@@ -3,57 +3,696 @@
 tennis-datafier - collect and query tennis match data
 
 Only supports the WTA at present, but could be extended to ATP with very
-little trouble (5 set matches are the only issue).
+little trouble: match_set keeps every set of 5 set matches, though the
+match table's own score columns stop at 3.
 """
 
+# only what the queries need is imported here; the ingestion and output
+# modules are imported where they're used, to keep the CLI's startup short
 import sqlite3
-import argparse
-import codecs
-import itertools 
+import collections
+import datetime
+import functools
 import re
-import math
-import readline
-import logging
-
-import drawsheet;
-
-def parse_score_components(score):
-    score_re = re.compile(
-            r"(?P<score>((?P<w1>[0-7])[/-]?(?P<l1>[0-7])(\((?P<tb1>\d+)\))?)"
-                     r"( (?P<w2>[0-7])[/-]?(?P<l2>[0-7])(\((?P<tb2>\d+)\))?)?"
-                     r"( (?P<w3>\d\d?)[/-]?(?P<l3>\d\d?)(\((?P<tb3>\d+)\))?)?"
-            r"( ([Rr]et\.|[Rr]et'd|[Rr]etired|[Rr]et))?"
-            r"|([Ww][Oo]\.?|[Ww]alkover))")
-    
-    m = score_re.match(score)
+import sys
+
+set_score = collections.namedtuple('set_score', 
+        'won lost tiebreak finished')
+"""
+one set of a match_score: games won and lost, the tiebreak points in
+brackets (None if there was no tiebreak), and whether it was played out
+"""
+
+match_score = collections.namedtuple('match_score', 
+        'text sets retired walkover')
+"""a parsed score: its text, a tuple of set_scores, and how it ended"""
+
+score_re = None
+"""regexs for the tokens of a score, compiled by score_regexes() on first use"""
+
+def score_regexes():
+    global score_re
+    if score_re == None:
+        score_re = (
+            # 6-4, 6/4 or 7-6(5)
+            re.compile(r"(\d{1,2})[-/](\d{1,2})(?:\((\d+)\))?$"),
+            # 64 or 76(5)
+            re.compile(r"([0-7])([0-7])(?:\((\d+)\))?$"),
+            # a tiebreak written apart from its set: 7-6 (5)
+            re.compile(r"\((\d+)\)$"),
+            re.compile(r"ret(\.|'d|d|ired)?$", re.IGNORECASE),
+            re.compile(r"(w[./]?o\.?|walkover)$", re.IGNORECASE),
+                )
+    return score_re
+
+def set_complete(won, lost, tiebreak):
+    """Whether a set score could be the end of a set"""
+    return (max(won, lost) >= 6 and 
+            (abs(won - lost) >= 2 or tiebreak != None or 
+                sorted((won, lost)) == [6, 7]))
+
+@functools.lru_cache(maxsize=4096)
+def parse_score(text):
+    """
+    Parse a score, in any of the forms the importers see, into a
+    match_score. Any number of sets is allowed. Parsing stops at the 
+    first word that isn't part of a score.
+
+    The last set of a retirement is unfinished unless it's a complete
+    set. Scores repeat a lot, so parses are cached.
+    """
+    sets_re, digits_re, tiebreak_re, retired_re, walkover_re = \
+            score_regexes()
+
+    text = (text or '').strip()
+    sets = []
+    retired = False
+    walkover = False
+    for word in text.replace(',', ' ').split():
+        m = sets_re.match(word) or digits_re.match(word)
+        if m != None:
+            won, lost, tiebreak = m.groups()
+            sets.append([int(won), int(lost), 
+                None if tiebreak == None else int(tiebreak)])
+        elif sets and sets[-1][2] == None and tiebreak_re.match(word):
+            sets[-1][2] = int(tiebreak_re.match(word).group(1))
+        elif retired_re.match(word):
+            retired = True
+        elif walkover_re.match(word):
+            walkover = True
+        else:
+            break
+
+    scores = []
+    for i, (won, lost, tiebreak) in enumerate(sets):
+        finished = (not retired or i < len(sets) - 1 or 
+                set_complete(won, lost, tiebreak))
+        scores.append(set_score(won, lost, tiebreak, finished))
+
+    return match_score(text, tuple(scores), retired, walkover)
+
+@functools.lru_cache(maxsize=4096)
+def score_columns(text):
+    """
+    The match table's MATCH_SCORE values for a score: its text, then the 
+    games and tiebreak of its first three sets, as text. With no sets 
+    at all, score_w_1 holds the text, as it always has.
+    """
+    s = parse_score(text)
+    if not s.sets:
+        return (s.text, s.text) + (None,) * 8
+
+    columns = [s.text]
+    for i in range(3):
+        if i < len(s.sets):
+            won, lost, tiebreak, finished = s.sets[i]
+            columns += [str(won), str(lost), 
+                    None if tiebreak == None else str(tiebreak)]
+        else:
+            columns += [None] * 3
+    return tuple(columns)
+
+def parse_date(text, last=False):
+    """
+    datetime.date for a YYYY, YYYY-MM or YYYY-MM-DD date. A partial date
+    means its first day, or its last day if 'last' is set. Raises 
+    ValueError for anything else.
+    """
+    import calendar
+
+    m = re.match(r'^(\d{4})(?:-(\d\d)(?:-(\d\d))?)?$', text.strip())
     if m == None:
-        return [score] * 2 + [None] * 8
-    else:
-        d = m.groupdict()
-        return [d['score'], 
-                d['w1'], d['l1'], d['tb1'], 
-                d['w2'], d['l2'], d['tb2'], 
-                d['w3'], d['l3'], d['tb3'],
-                ]
-
-def get_date_clause(start, end):
+        raise ValueError('invalid date: {}'.format(text))
+
+    year, month, day = m.groups()
+    year = int(year)
+    if month == None:
+        month = 12 if last else 1
+    month = int(month)
+    try:
+        if day == None:
+            day = calendar.monthrange(year, month)[1] if last else 1
+        return datetime.date(year, month, int(day))
+    except ValueError:
+        raise ValueError('invalid date: {}'.format(text))
+
+def day_number(text, last=False):
+    """
+    The julian day number of a date, as stored in tournament.day
+    """
+    return parse_date(text, last).toordinal() + 1721424
+
+def day_sql(column):
+    """
+    SQL for the julian day number of a date column, padding partial 
+    dates out to their first day
+    """
+    return ("CAST(julianday(CASE length({0}) "
+            "WHEN 4 THEN {0} || '-01-01' "
+            "WHEN 7 THEN {0} || '-01' "
+            "ELSE {0} END) AS INTEGER)".format(column))
+
+def date_filter(start, end):
+    """
+    (clause, params) restricting tournament.day to the start and end 
+    dates, both inclusive. The clause text doesn't depend on the dates,
+    so the statements built with it stay in the statement cache.
+    """
     if not start and not end:
-        return ''
+        return ' ', []
+
+    return (' AND day BETWEEN ? AND ? ', 
+            [day_number(start) if start else 0,
+             day_number(end, True) if end else 99999999])
+
+def surface_filter(surface):
+    """
+    (clause, params) restricting tournament.surface to those ending in
+    surface, so that 'Clay' takes in Red Clay and Green Clay, as the
+    summaries of print_record do
+    """
+    if not surface:
+        return ' ', []
+
+    return " AND surface LIKE '%' || ? ", [surface]
+
+def make_percent(wins, losses):
+    """wins as a fraction of wins and losses, for printing; 'Inf' if none"""
+    if wins + losses == 0:
+        return 'Inf'
+    else:
+        return float(wins) / (wins + losses)
+
+def in_list(values):
+    """
+    (placeholders, params) for an IN list of values, padded with NULLs to
+    a power of two so that lists of similar length share one statement
+    """
+    size = 8
+    while size < len(values):
+        size *= 2
+
+    return ','.join('?' * size), list(values) + [None] * (size - len(values))
+
+def parse_text_player(p, info):
+    """
+    Split a text-data player and her [country][status] info into
+    (first, last, country, status)
+    """
+    last, first = [s.strip() for s in p.split(',')]
+    info = [s.strip().lstrip('[') for s in info.split(']')]
+    if len(info) == 0:
+        country = ''
+        status = ''
+    elif len(info) == 1:
+        country = info[0]
+        status = ''
+    else:
+        country, status = info[:2]
+
+    if country.isdigit():
+        status = country
+        country = ''
+
+    return first, last, country, status
+
+def parse_text_match(line):
+    """
+    Split a text-data match line into 
+    (round, p1, p1_info, p2, p2_info, score); p2 is None for a bye
+    """
+    rnd, sep, rest = line.partition('"')
+    rnd = rnd.strip()
+    p1, sep, rest = rest.partition('"')
+    p1_info, sep, rest = rest.partition(' ')
+
+    if rest.strip() == 'bye;':
+        return rnd, p1, p1_info, None, None, 'bye'
+
+    rest = rest.partition('"')[2]
+    p2, sep, rest = rest.partition('"')
+    p2_info, sep, rest = rest.partition(' ')
+    score = rest.partition(';')[0]
+
+    return rnd, p1, p1_info, p2, p2_info, score
+
+text_tournament = collections.namedtuple('text_tournament',
+        'city name country date surface t_class')
+"""a text-data tournament, in the column order tournament_id() takes"""
+
+text_player = collections.namedtuple('text_player',
+        'first last country status')
+"""a player in a text-data match line"""
+
+text_match = collections.namedtuple('text_match', 
+        'round p1 p2 score scores')
+"""
+a text-data match; p2 is None for a bye, scores is the score_w/l/tb
+columns of score_columns
+"""
+
+def parse_text_data(lines):
+    """
+    Parse text-data lines into a stream of text_tournament and text_match
+    records, each tournament followed by its matches. Lines are consumed
+    as they're read, so an archive of any size parses in constant memory.
+    """
+    intourney = False
+    inmatches = False
+    infoline = 0
+    city, t_name, t_country, date, surface, t_class = [''] * 6
+    for line in lines:
+        l = line.strip()
+        if l == 'Start':
+            intourney = True
+            continue
+
+        if not intourney:
+            continue
+
+        if l == ':':
+            inmatches = True
+            yield text_tournament(city, t_name, t_country, 
+                    date, surface, t_class)
+            continue
+
+        if l == 'Stop':
+            inmatches = False
+            intourney = False
+            infoline = 0
+            city, t_name, t_country, date, surface, t_class = [''] * 6
+            continue
+
+        if not inmatches:
+            if infoline == 0:
+                city, t_name, t_country = [s.strip() for s in l.split(';')[:3]]
+                infoline = 1
+            elif infoline == 1:
+                date, surface, t_class = [s.strip() for s in l.split(';')[:3]]
+                infoline = 2
+        else:
+            rnd, p1, p1_info, p2, p2_info, score = parse_text_match(l)
+            p1 = text_player(*parse_text_player(p1, p1_info))
+            if p2 is not None:
+                p2 = text_player(*parse_text_player(p2, p2_info))
+            yield text_match(rnd, p1, p2, score, 
+                    list(score_columns(score)[1:]))
+
+def text_blocks(filename, size):
+    """
+    Split a text-data file into (start, end) byte ranges of about size
+    bytes. Each range ends just after a Stop line, where the parser is
+    back in its initial state, so the ranges parse independently.
+    """
+    f = open(filename, 'rb')
+    total = f.seek(0, 2)
+    blocks = []
+    start = 0
+    while start < total:
+        f.seek(start + size)
+        f.readline() # probably partway through a line
+        end = total
+        line = f.readline()
+        while line:
+            if line.strip() == b'Stop':
+                end = f.tell()
+                break
+            line = f.readline()
+
+        blocks += [(start, end)]
+        start = end
+    f.close()
+    return blocks
+
+def parse_text_block(filename, start, end, encoding):
+    """
+    The parse_text_data records of one text_blocks range, as a list
+    """
+    import io
+
+    f = open(filename, 'rb')
+    f.seek(start)
+    text = f.read(end - start).decode(encoding)
+    f.close()
+    return list(parse_text_data(io.StringIO(text, newline=None)))
+
+MATCH_KEY = ('round', 't_id', 'winner', 'loser')
+MATCH_SCORE = ('score', 'score_w_1', 'score_l_1', 'score_tb_1',
+        'score_w_2', 'score_l_2', 'score_tb_2',
+        'score_w_3', 'score_l_3', 'score_tb_3')
+"""a match row is its MATCH_KEY values followed by its MATCH_SCORE ones"""
+
+def fingerprint(paths, extra=''):
+    """
+    SHA-256 hex digest of the contents of paths (None entries are 
+    skipped) and the string extra
+    """
+    import hashlib
+
+    h = hashlib.sha256()
+    for path in paths:
+        if path == None:
+            continue
+
+        f = open(path, 'rb')
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+        f.close()
+        h.update(b'\0')
+
+    h.update(extra.encode('utf-8'))
+    return h.hexdigest()
+
+def drawsheet_fingerprint(filename, qualies):
+    """
+    Fingerprint of a drawsheet import: the file, its metadata sidecar
+    and which draw is taken from it
+    """
+    import drawsheet
+
+    return fingerprint([filename, drawsheet.sidecar_path(filename)],
+            'qualifying' if qualies else 'main')
+
+RECORD_SURFACE = "coalesce(surface, '')"
+RECORD_YEAR = 'coalesce(CAST(substr(date, 1, 4) AS INTEGER), 0)'
+"""how player_vs_record's surface and year come from a tournament"""
+
+def record_delta(row, op):
+    """
+    Trigger statements that add (op '+') or remove (op '-') the match in
+    row (NEW or OLD) from player_vs_record
+    """
+    where_t = '(SELECT {} FROM tournament WHERE t_id={}.t_id)'
+    surface = where_t.format(RECORD_SURFACE, row)
+    year = where_t.format(RECORD_YEAR, row)
+
+    sql = ''
+    for p, opp, col in (('winner', 'loser', 'wins'), 
+            ('loser', 'winner', 'losses')):
+        sql += ('INSERT OR IGNORE INTO player_vs_record'
+                '(p_id, opp_id, surface, year) '
+                'VALUES ({row}.{p}, {row}.{opp}, {surface}, {year}); '
+                'UPDATE player_vs_record SET {col}={col} {op} 1 '
+                'WHERE p_id={row}.{p} AND opp_id={row}.{opp} '
+                'AND surface={surface} AND year={year}; '.format(
+                    row=row, p=p, opp=opp, col=col, op=op,
+                    surface=surface, year=year))
+
+    if op == '-':
+        sql += ('DELETE FROM player_vs_record WHERE wins=0 AND losses=0 '
+                'AND p_id IN ({0}.winner, {0}.loser) '
+                'AND opp_id IN ({0}.winner, {0}.loser); '.format(row))
+    return sql
+
+def games_sql(column, missing='NULL'):
+    """
+    SQL for a stored set score as an integer, or missing if it isn't a
+    number of at most two digits
+    """
+    return ("CASE WHEN {0} GLOB '[0-9]' OR {0} GLOB '[0-9][0-9]' "
+            "THEN CAST({0} AS INTEGER) ELSE {1} END".format(column, missing))
+
+set_stats = collections.namedtuple('set_stats', 
+        'matches tiebreaks_won tiebreaks_lost deciders_won deciders_lost '
+        'bagels_won bagels_lost breadsticks_won breadsticks_lost '
+        'games_won games_lost comebacks set_down')
+"""
+a player's set-level stats: the matches with set scores, tiebreak and
+deciding set records, 6-0 and 6-1 sets, games, and the matches won 
+after losing the first set out of those where she lost it
+"""
 
-    clause = ' AND ('
+ELO_START = 1500
+
+def rating_dirty_sql(day):
+    """
+    Statement lowering the 'rating_dirty' day, from which ratings must be
+    replayed, to day (an SQL expression) if it is earlier
+    """
+    return ("UPDATE info SET value={0} WHERE key='rating_dirty' "
+            "AND {0} IS NOT NULL AND (value IS NULL OR value > {0})".
+            format(day))
+
+def round_order(rnd):
+    """
+    Sort key putting a tournament's rounds in playing order: qualifying
+    rounds, numbered rounds, then QF, SF and F
+    """
+    m = re.match(r'([qQ]?)[rR]?(\d+)$', rnd or '')
+    if m != None:
+        return (m.group(1) == '', int(m.group(2)), '')
+    late = {'QF': 100, 'SF': 101, 'F': 102}
+    return (True, late.get(rnd.upper() if rnd else rnd, 99), rnd or '')
+
+def elo_update(winner, loser):
+    """
+    New [rating, matches] lists for a winner and loser given theirs; the
+    K factor shrinks as a player's matches build up
+    """
+    expected = 1 / (1 + 10 ** ((loser[0] - winner[0]) / 400))
+    k_w = 250 / (winner[1] + 5) ** 0.4
+    k_l = 250 / (loser[1] + 5) ** 0.4
+    return ([winner[0] + k_w * (1 - expected), winner[1] + 1],
+            [loser[0] - k_l * (1 - expected), loser[1] + 1])
+
+def year_bounds(start, end):
+    """
+    (first_year, last_year) if the date range covers whole years, which
+    player_vs_record can answer exactly; otherwise None. Either year is 
+    None if unbounded.
+    """
+    first = last = None
     if start:
-         clause += "date >= '{}'".format(start)
-    if start and end:
-         clause += ' AND '
+        d = parse_date(start)
+        if (d.month, d.day) != (1, 1):
+            return None
+        first = d.year
     if end:
-         clause += "date <= '{}'".format(end)
-    clause += ') '
-    return clause
+        d = parse_date(end, True)
+        if (d.month, d.day) != (12, 31):
+            return None
+        last = d.year
+
+    return first, last
+
+def normalize_name(name):
+    """
+    name as the resolver compares it: case-folded, without accents, and
+    with hyphens and runs of spaces as single spaces
+    """
+    if name == None:
+        return ''
+    if not name.isascii():
+        import unicodedata
+        name = ''.join(ch for ch in unicodedata.normalize('NFKD', name)
+                if not unicodedata.combining(ch))
+    return ' '.join(name.casefold().replace('-', ' ').split())
+
+def trigrams(text):
+    """
+    The set of trigrams of a normalized name, each word padded with two
+    spaces in front and one behind
+    """
+    grams = set()
+    for word in text.split():
+        word = '  ' + word + ' '
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+def split_player(name):
+    """
+    (first, last) of a command line PLAYER, 'Last', 'First Last' or
+    'Last, First', normalized; first is None if not given
+    """
+    if ',' in name:
+        l, f = name.split(',', 1)
+    elif ' ' in name.strip():
+        f, l = name.strip().split(' ', 1)
+    else:
+        l, f = name, None
+
+    if f != None:
+        f = normalize_name(f)
+    return f, normalize_name(l)
+
+class player_resolver:
+    """
+    In-memory map of normalized player names to p_ids, read from the
+    player table once. Whoever inserts a player adds it here too.
+
+    Fuzzy searches go through trigram indexes of the distinct first and
+    last names, built the first time one is needed.
+    """
+    FUZZY_THRESHOLD = 0.4
+    FUZZY_LIMIT = 10
+
+    def __init__(self, c):
+        self.p_ids = {}
+        self.names = {}
+        self.firsts = []
+        self.lasts = []
+        self.sorted = True
+        self.word_grams = None
+        c.execute('SELECT p_id, firstname, lastname FROM player '
+                'ORDER BY p_id')
+        for p_id, first, last in c.fetchall():
+            self.add(p_id, first, last)
+
+    def add(self, p_id, first, last):
+        first, last = normalize_name(first), normalize_name(last)
+        self.p_ids.setdefault((first, last), []).append(p_id)
+        self.names[p_id] = (first, last)
+        self.firsts.append((first, p_id))
+        self.lasts.append((last, p_id))
+        self.sorted = False
+        if self.word_grams != None:
+            self.index(p_id)
+
+    def lookup(self, first, last):
+        """The p_id of the player with this name, or None"""
+        p_ids = self.p_ids.get((normalize_name(first), normalize_name(last)))
+        if p_ids == None:
+            return None
+        return p_ids[0]
+
+    def find(self, names, text, exact=False):
+        """
+        The set of p_ids in names (self.firsts or self.lasts) whose name
+        starts with text, or is text if exact; text may be a glob pattern
+        """
+        import bisect
+
+        if any(ch in text for ch in '*?['):
+            import fnmatch
+            if not exact:
+                text += '*'
+            return {p for n, p in names if fnmatch.fnmatchcase(n, text)}
+
+        if not self.sorted:
+            self.firsts.sort()
+            self.lasts.sort()
+            self.sorted = True
+
+        found = set()
+        for i in range(bisect.bisect_left(names, (text,)), len(names)):
+            n, p = names[i]
+            if n != text and (exact or not n.startswith(text)):
+                break
+            found.add(p)
+        return found
+
+    def search(self, name):
+        """
+        p_ids for a command line PLAYER, each part a prefix or glob 
+        pattern
+        """
+        f, l = split_player(name)
+        if f == None:
+            found = self.find(self.lasts, l) or self.find(self.firsts, l)
+        else:
+            found = (self.find(self.firsts, f, True) &
+                    self.find(self.lasts, l, True))
+            if not found:
+                found = self.find(self.firsts, f) & self.find(self.lasts, l)
+
+        return sorted(found)
+
+    def index(self, p_id):
+        for word, which in zip(self.names[p_id], ('first', 'last')):
+            players, grams = self.words[which]
+            if word not in players:
+                players[word] = []
+                if word not in self.word_grams:
+                    self.word_grams[word] = trigrams(word)
+                for g in self.word_grams[word]:
+                    grams.setdefault(g, []).append(word)
+            players[word].append(p_id)
+
+    def similar(self, text, which):
+        """
+        [(shared, extra, word)] for the distinct first or last names 
+        sharing at least FUZZY_THRESHOLD of text's trigrams, with how 
+        many other trigrams each has
+        """
+        import math
+
+        players, grams = self.words[which]
+        q_grams = trigrams(text)
+        if not q_grams:
+            return []
+
+        # a name sharing 'needed' of the query's trigrams has at least one
+        # of its len - needed + 1 rarest, so only those lists are read
+        needed = math.ceil(self.FUZZY_THRESHOLD * len(q_grams))
+        rarest = sorted(q_grams, key=lambda g: len(grams.get(g, ())))
+        candidates = set()
+        for g in rarest[:len(q_grams) - needed + 1]:
+            candidates.update(grams.get(g, ()))
+
+        found = []
+        for word in candidates:
+            shared = len(q_grams & self.word_grams[word])
+            if shared >= needed:
+                found.append((shared, len(self.word_grams[word]) - shared,
+                    word))
+        return found
+
+    def fuzzy(self, name):
+        """
+        p_ids whose names are closest to a PLAYER by trigram similarity,
+        best first. The last name (or the one name given) picks the
+        candidates, a first name narrows them down.
+        """
+        if self.word_grams == None:
+            self.word_grams = {}
+            self.words = {'first': ({}, {}), 'last': ({}, {})}
+            for p_id in self.names:
+                self.index(p_id)
+
+        f, l = split_player(name)
+        ranked = []
+        if f == None:
+            for which in ('last', 'first'):
+                players = self.words[which][0]
+                for shared, extra, word in self.similar(l, which):
+                    ranked += [(-shared, extra, p) for p in players[word]]
+                if ranked:
+                    break
+        else:
+            firsts = {word: (shared, extra) 
+                    for shared, extra, word in self.similar(f, 'first')}
+            players = self.words['last'][0]
+            for shared, extra, word in self.similar(l, 'last'):
+                for p in players[word]:
+                    first = self.names[p][0]
+                    if first in firsts:
+                        ranked += [(-shared - firsts[first][0], 
+                            extra + firsts[first][1], p)]
+
+        ranked.sort()
+        return [p for shared, extra, p in ranked[:self.FUZZY_LIMIT]]
+
+    def complete(self, text):
+        """
+        p_ids to offer for a partly typed name: the search results, or
+        the fuzzy ones if there are none
+        """
+        if not text.strip():
+            return []
+        return self.search(text) or self.fuzzy(text)
 
 class db:
     def __init__(self, dbfile):
-        self.DB_VERSION = 1
-        self.conn = sqlite3.connect(dbfile);
+        self.DB_VERSION = 7
+        self.NAME_CACHE_SIZE = 10000
+        self.STATEMENT_CACHE_SIZE = 256
+        self.TEXT_BLOCK_SIZE = 4 * 1024 * 1024
+        self.name_cache = collections.OrderedDict()
+        self.players = None
+        # queries keep their text fixed and bind everything else, so the
+        # connection's statement cache serves the repeats
+        self.conn = sqlite3.connect(dbfile, 
+                cached_statements=self.STATEMENT_CACHE_SIZE);
         c = self.conn.cursor()
         try: 
             c.execute('SELECT value FROM info WHERE key="version"')
@@ -99,13 +738,474 @@ class db:
                     'score_w_3, score_l_3, score_tb_1, score_tb_2, '
                     'score_tb_3, PRIMARY KEY(round, t_id, winner, loser))')
 
+        if (version < 2): # secondary indexes for the action_* queries
+            c.execute('CREATE INDEX IF NOT EXISTS match_winner_loser '
+                    'ON match(winner, loser, t_id)')
+            c.execute('CREATE INDEX IF NOT EXISTS match_loser_winner '
+                    'ON match(loser, winner, t_id)')
+            c.execute('CREATE INDEX IF NOT EXISTS tournament_date '
+                    'ON tournament(date)')
+            c.execute('CREATE INDEX IF NOT EXISTS player_name '
+                    'ON player(lower(lastname), lower(firstname))')
+            c.execute('CREATE INDEX IF NOT EXISTS player_tournament_tp '
+                    'ON player_tournament(t_id, p_id)')
+            c.execute('ANALYZE')
+
+        if (version < 3): # per-opponent records, kept current by triggers
+            c.execute('CREATE TABLE player_vs_record('
+                    'p_id NOT NULL REFERENCES player(p_id), '
+                    'opp_id NOT NULL REFERENCES player(p_id), '
+                    'surface NOT NULL, year NOT NULL, '
+                    'wins NOT NULL DEFAULT 0, losses NOT NULL DEFAULT 0, '
+                    'PRIMARY KEY(p_id, opp_id, surface, year))')
+            c.execute('CREATE TRIGGER match_record_insert '
+                    'AFTER INSERT ON match WHEN NEW.loser IS NOT NULL '
+                    'BEGIN ' + record_delta('NEW', '+') + ' END')
+            c.execute('CREATE TRIGGER match_record_delete '
+                    'AFTER DELETE ON match WHEN OLD.loser IS NOT NULL '
+                    'BEGIN ' + record_delta('OLD', '-') + ' END')
+            c.execute('CREATE TRIGGER match_record_update '
+                    'AFTER UPDATE OF t_id, winner, loser ON match '
+                    'BEGIN ' + record_delta('OLD', '-') + 
+                        record_delta('NEW', '+') + ' END')
+            self.rebuild_player_vs_record(c)
+
+        if (version < 4): # indexed day numbers for date filtering
+            c.execute('ALTER TABLE tournament ADD COLUMN day INTEGER')
+            c.execute('UPDATE tournament SET day=' + day_sql('date'))
+            c.execute('CREATE INDEX tournament_day ON tournament(day)')
+            c.execute('CREATE TRIGGER tournament_day_insert '
+                    'AFTER INSERT ON tournament '
+                    'BEGIN UPDATE tournament SET day=' + day_sql('NEW.date') +
+                    ' WHERE t_id=NEW.t_id; END')
+            c.execute('CREATE TRIGGER tournament_day_update '
+                    'AFTER UPDATE OF date ON tournament '
+                    'BEGIN UPDATE tournament SET day=' + day_sql('NEW.date') +
+                    ' WHERE t_id=NEW.t_id; END')
+            c.execute('ANALYZE')
+
+        if (version < 5): # fingerprints of imported files
+            c.execute('CREATE TABLE import_log(path PRIMARY KEY, '
+                    'hash NOT NULL, t_ids NOT NULL, date NOT NULL)')
+
+        if (version < 6): # surface elo ratings
+            c.execute('CREATE TABLE rating_history(p_id INTEGER, surface, '
+                    'day INTEGER, t_id INTEGER, round, rating REAL, '
+                    'matches INTEGER)')
+            c.execute('CREATE INDEX rating_history_player '
+                    'ON rating_history(p_id, surface, day)')
+            c.execute('CREATE INDEX rating_history_day '
+                    'ON rating_history(day)')
+            c.execute('CREATE TABLE rating(p_id INTEGER, surface, '
+                    'rating REAL, matches INTEGER, '
+                    'PRIMARY KEY(p_id, surface))')
+            # nothing rated yet, so replay from the very first day
+            c.execute("INSERT INTO info(key, value) "
+                    "VALUES ('rating_dirty', 0)")
+
+            t_day = '(SELECT day FROM tournament WHERE t_id={}.t_id)'
+            c.execute('CREATE TRIGGER match_rating_insert '
+                    'AFTER INSERT ON match BEGIN ' + 
+                    rating_dirty_sql(t_day.format('NEW')) + '; END')
+            c.execute('CREATE TRIGGER match_rating_delete '
+                    'AFTER DELETE ON match BEGIN ' + 
+                    rating_dirty_sql(t_day.format('OLD')) + '; END')
+            c.execute('CREATE TRIGGER match_rating_update '
+                    'AFTER UPDATE OF round, t_id, winner, loser, score_w_1 '
+                    'ON match BEGIN ' + 
+                    rating_dirty_sql(t_day.format('OLD')) + '; ' +
+                    rating_dirty_sql(t_day.format('NEW')) + '; END')
+            c.execute('CREATE TRIGGER tournament_rating_update '
+                    'AFTER UPDATE OF day, surface ON tournament BEGIN ' + 
+                    rating_dirty_sql('OLD.day') + '; ' +
+                    rating_dirty_sql('NEW.day') + '; END')
+            # so replays can go from a tournament's day to its matches
+            c.execute('CREATE INDEX match_t_id ON match(t_id)')
+            c.execute('ANALYZE')
+
+        if (version < 7): # one row per set, for set-level stats
+            c.execute('CREATE TABLE match_set(round, t_id, winner, loser, '
+                    'set_no INTEGER, won INTEGER, lost INTEGER, '
+                    'tiebreak INTEGER, finished INTEGER, '
+                    'PRIMARY KEY(t_id, round, winner, loser, set_no))')
+            match_key = ('round=OLD.round AND t_id=OLD.t_id AND '
+                    'winner=OLD.winner AND loser IS OLD.loser')
+            # the importers write a match's sets; these keep them with it
+            c.execute('CREATE TRIGGER match_set_delete '
+                    'AFTER DELETE ON match BEGIN '
+                    'DELETE FROM match_set WHERE ' + match_key + '; END')
+            c.execute('CREATE TRIGGER match_set_update '
+                    'AFTER UPDATE OF round, t_id, winner, loser ON match '
+                    'BEGIN UPDATE match_set SET round=NEW.round, '
+                    't_id=NEW.t_id, winner=NEW.winner, loser=NEW.loser '
+                    'WHERE ' + match_key + '; END')
+            self.rebuild_match_set(c)
+
         c.execute('INSERT OR REPLACE INTO info(key, value) VALUES (?, ?)',
             ['version', self.DB_VERSION])
         self.conn.commit()
         c.close()
 
 
+    def rebuild_player_vs_record(self, c = None):
+        """
+        Recompute player_vs_record from scratch
+        """
+        if c == None:
+            c = self.conn.cursor()
+
+        c.execute('DELETE FROM player_vs_record')
+        c.execute("""
+            INSERT INTO player_vs_record(p_id, opp_id, surface, year, 
+                wins, losses)
+            SELECT p_id, opp_id, surface, year, sum(wins), sum(losses)
+            FROM (SELECT winner AS p_id, loser AS opp_id, t_id, 
+                        1 AS wins, 0 AS losses
+                    FROM match WHERE loser IS NOT NULL
+                UNION ALL
+                SELECT loser AS p_id, winner AS opp_id, t_id, 
+                        0 AS wins, 1 AS losses
+                    FROM match WHERE loser IS NOT NULL)
+            NATURAL INNER JOIN 
+                (SELECT t_id, """ + RECORD_SURFACE + """ AS surface, 
+                    """ + RECORD_YEAR + """ AS year 
+                FROM tournament)
+            GROUP BY p_id, opp_id, surface, year""")
+
+
+    def write_sets(self, c, matches, replace=True):
+        """
+        Write the match_set rows of matches, (round, t_id, winner, loser,
+        score) rows, first deleting any they had if replace is set
+        """
+        keys = []
+        sets = []
+        for key in matches:
+            key = tuple(key[:5])
+            keys.append(key[:4])
+            for i, s in enumerate(parse_score(key[4]).sets):
+                sets.append(key[:4] + (i + 1,) + s)
+
+        if replace:
+            c.executemany('DELETE FROM match_set WHERE round=? AND t_id=? '
+                    'AND winner=? AND loser IS ?', keys)
+        c.executemany('INSERT INTO match_set(round, t_id, winner, loser, '
+                'set_no, won, lost, tiebreak, finished) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', sets)
+
+    def rebuild_match_set(self, c = None):
+        """
+        Recompute match_set from the scores in match
+        """
+        if c == None:
+            c = self.conn.cursor()
+
+        c.execute('DELETE FROM match_set')
+        c.execute('SELECT round, t_id, winner, loser, score FROM match')
+        self.write_sets(c, c.fetchall(), replace=False)
+
+    def update_ratings(self, c = None):
+        """
+        Bring the elo ratings up to date with the match table; the caller
+        commits.
+
+        Triggers on match and tournament keep the earliest day whose 
+        matches changed since the last update. History from that day on 
+        is dropped and replayed from the ratings just before it, so new 
+        draws cost only their own matches.
+
+        Only matches that were played count: not byes, nor walkovers, 
+        which have no games in their first set. Returns the number of 
+        matches rated.
+        """
+        import itertools
+
+        if c == None:
+            c = self.conn.cursor()
+
+        c.execute("SELECT value FROM info WHERE key='rating_dirty'")
+        dirty = c.fetchone()[0]
+        if dirty == None:
+            return 0
+
+        c.execute('SELECT max(day) FROM rating_history')
+        last = c.fetchone()[0]
+        if last != None and last >= dirty:
+            c.execute('DELETE FROM rating_history WHERE day >= ?', [dirty])
+            c.execute('DELETE FROM rating')
+            # the last row of each player's history has her rating
+            c.execute('INSERT INTO rating(p_id, surface, rating, matches) '
+                    'SELECT p_id, surface, rating, matches FROM '
+                    '(SELECT p_id, surface, rating, matches, max(rowid) '
+                    'FROM rating_history GROUP BY p_id, surface)')
+
+        c.execute('SELECT p_id, surface, rating, matches FROM rating')
+        ratings = {(p, s): [r, n] for p, s, r, n in c.fetchall()}
+        touched = set()
+
+        # tournaments from the day on first, then their matches by t_id;
+        # the unary + keeps the integer affinity of tournament.t_id from 
+        # ruling out match_t_id
+        c.execute('SELECT t.t_id, day, ' + RECORD_SURFACE + ', round, '
+                'winner, loser FROM tournament t CROSS JOIN match m '
+                'ON m.t_id=+t.t_id '
+                'WHERE day >= ? AND loser IS NOT NULL '
+                "AND score_w_1 GLOB '[0-9]*' "
+                'ORDER BY day, t.t_id', [dirty])
+        history = []
+        rated = 0
+        orders = {}
+        def order(row):
+            if row[3] not in orders:
+                orders[row[3]] = round_order(row[3])
+            return orders[row[3]], row[4], row[5]
+
+        for (t_id, day), rows in itertools.groupby(c.fetchall(), 
+                key=lambda r: r[:2]):
+            for t_id, day, surface, rnd, w, l in sorted(rows, key=order):
+                w_key, l_key = (w, surface), (l, surface)
+                for key in (w_key, l_key):
+                    if key not in ratings:
+                        ratings[key] = [ELO_START, 0]
+                    touched.add(key)
+                ratings[w_key], ratings[l_key] = elo_update(ratings[w_key],
+                        ratings[l_key])
+                history += [(w, surface, day, t_id, rnd) + 
+                        tuple(ratings[w_key]),
+                    (l, surface, day, t_id, rnd) + tuple(ratings[l_key])]
+                rated += 1
+
+        c.executemany('INSERT INTO rating_history(p_id, surface, day, t_id, '
+                'round, rating, matches) VALUES (?, ?, ?, ?, ?, ?, ?)', 
+                history)
+        c.executemany('INSERT OR REPLACE INTO rating(p_id, surface, rating, '
+                'matches) VALUES (?, ?, ?, ?)', 
+                [key + tuple(ratings[key]) for key in touched])
+        c.execute("UPDATE info SET value=NULL WHERE key='rating_dirty'")
+        return rated
+
+    def rebuild_ratings(self, c = None):
+        """Recompute all ratings from the first match; the caller commits"""
+        if c == None:
+            c = self.conn.cursor()
+
+        c.execute('DELETE FROM rating_history')
+        c.execute('DELETE FROM rating')
+        c.execute("UPDATE info SET value=0 WHERE key='rating_dirty'")
+        return self.update_ratings(c)
+
+    def ratings(self, pids, date=None):
+        """
+        Elo ratings of pids on or before date (None is now), updating 
+        them first if need be.
+
+        Returns {pid: {surface: (rating, matches)}}.
+        """
+        c = self.conn.cursor()
+        if self.update_ratings(c):
+            self.conn.commit()
+
+        results = {p: {} for p in pids}
+        for i in range(0, len(pids), 256):
+            marks, params = in_list(pids[i:i + 256])
+            if date == None:
+                c.execute('SELECT p_id, surface, rating, matches '
+                        'FROM rating WHERE p_id IN (' + marks + ')', params)
+            else:
+                c.execute('SELECT p_id, surface, rating, matches, '
+                        'max(rowid) FROM rating_history '
+                        'WHERE p_id IN (' + marks + ') AND day <= ? '
+                        'GROUP BY p_id, surface', 
+                        params + [day_number(date, True)])
+            for p, surface, rating, matches in (r[:4] for r in c):
+                results[p][surface] = (rating, matches)
+
+        c.close()
+        return results
+
+    def top_ratings(self, n, date=None):
+        """
+        The n highest rated players on each surface on or before date 
+        (None is now), as {surface: [(pid, rating, matches)]}
+        """
+        c = self.conn.cursor()
+        if self.update_ratings(c):
+            self.conn.commit()
+
+        if date == None:
+            c.execute('SELECT p_id, surface, rating, matches FROM rating '
+                    'ORDER BY rating DESC')
+        else:
+            c.execute('SELECT p_id, surface, rating, matches FROM '
+                    '(SELECT p_id, surface, rating, matches, max(rowid) '
+                    'FROM rating_history WHERE day <= ? '
+                    'GROUP BY p_id, surface) ORDER BY rating DESC', 
+                    [day_number(date, True)])
+
+        results = collections.defaultdict(list)
+        for p, surface, rating, matches in c:
+            if len(results[surface]) < n:
+                results[surface] += [(p, rating, matches)]
+
+        c.close()
+        return results
+
+    def action_ratings(self, players, date=None):
+        """
+        Print players' elo ratings as of date, or the top ELO_TOP players
+        on each surface if no players are given
+        """
+        ELO_TOP = 20
+
+        as_of = ' as of ' + date if date else ''
+        if not players:
+            top = self.top_ratings(ELO_TOP, date)
+            self.prefetch_names([p for s in top.values() for p, r, n in s])
+            for surface in sorted(top):
+                print()
+                print('Top {} elo ratings on {}{}:'.format(ELO_TOP, 
+                    surface or 'unknown surface', as_of))
+                for i, (p, rating, matches) in enumerate(top[surface]):
+                    print('{:3}. {:<30} {:5.0f} ({} matches)'.format(
+                        i + 1, self.namefl(p), rating, matches))
+            return
+
+        pids = []
+        for p in players:
+            pids += self.get_pids(p)
+        self.prefetch_names(pids)
+        ratings = self.ratings(pids, date)
+
+        for p in pids:
+            print()
+            print('Elo ratings for {}{}:'.format(self.namefl(p), as_of))
+            if not ratings[p]:
+                print('no rated matches')
+            for surface, (rating, matches) in sorted(ratings[p].items()):
+                print('{:<12} {:5.0f} ({} matches)'.format(
+                    surface or 'unknown', rating, matches))
+
+    def write_match(self, c, row):
+        """
+        Add the match in row, or bring its score up to date; nothing is
+        written if it's unchanged.
+
+        Returns 'added', 'updated' or None.
+        """
+        row = list(row)
+        c.execute('SELECT ' + ', '.join(MATCH_SCORE) + ' FROM match '
+                'WHERE round=? AND t_id=? AND winner=? AND loser IS ?', 
+                row[:4])
+        r = c.fetchone()
+        if r == None:
+            c.execute('INSERT INTO match(' + 
+                    ', '.join(MATCH_KEY + MATCH_SCORE) + ') '
+                    'VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)', row)
+            self.write_sets(c, [row], replace=False)
+            return 'added'
+
+        if list(r) == row[4:]:
+            return None
+
+        c.execute('UPDATE match SET ' + 
+                ', '.join(s + '=?' for s in MATCH_SCORE) + ' '
+                'WHERE round=? AND t_id=? AND winner=? AND loser IS ?',
+                row[4:] + row[:4])
+        self.write_sets(c, [row])
+        return 'updated'
+
+    def import_unchanged(self, path, digest):
+        """
+        True if path was last imported with the same fingerprint
+        """
+        import os
+
+        c = self.conn.cursor()
+        c.execute('SELECT hash FROM import_log WHERE path=?',
+                [os.path.abspath(path)])
+        r = c.fetchone()
+        c.close()
+
+        return r != None and r[0] == digest
+
+    def log_import(self, c, path, digest, t_ids):
+        """
+        Record that path, with fingerprint digest, has been imported into
+        t_ids; the caller commits
+        """
+        import os
+
+        c.execute('INSERT OR REPLACE INTO import_log(path, hash, t_ids, date) '
+                "VALUES (?, ?, ?, datetime('now'))",
+                [os.path.abspath(path), digest, 
+                    ' '.join(str(t) for t in sorted(set(t_ids)))])
+
+    def skip_unchanged(self, path, digest, force):
+        """
+        Whether to skip importing path, telling the user if so
+        """
+        if force or not self.import_unchanged(path, digest):
+            return False
+
+        print('{}: unchanged since it was last imported, skipping '
+                '(--force to re-import)'.format(path))
+        return True
+
+    def drop_triggers(self, c, names):
+        """
+        Drop the named triggers for a bulk load, inside a transaction so
+        that a rollback restores them. Returns the statements that 
+        re-create them, which the caller runs when done.
+        """
+        if not self.conn.in_transaction:
+            c.execute('BEGIN')
+
+        triggers = []
+        for name in names:
+            c.execute('SELECT sql FROM sqlite_master '
+                    "WHERE type='trigger' AND name=?", [name])
+            triggers += [c.fetchone()[0]]
+            c.execute('DROP TRIGGER ' + name)
+        return triggers
+
+    def resolver(self, c = None):
+        """
+        The player_resolver for this connection, loaded on first use
+        """
+        if self.players == None:
+            if c == None:
+                c = self.conn.cursor()
+            self.players = player_resolver(c)
+        return self.players
+
+    def rollback(self):
+        """
+        Roll back, forgetting anything cached about uncommitted players
+        """
+        self.conn.rollback()
+        self.name_cache.clear()
+        self.players = None
+
+    def action_rebuild(self):
+        c = self.conn.cursor()
+        self.rebuild_player_vs_record(c)
+        self.rebuild_match_set(c)
+        self.rebuild_ratings(c)
+        c.execute('ANALYZE')
+        self.conn.commit()
+        c.close()
+        print('Rebuilt derived tables')
+
     def insert_tournament_manually(self):
+        import readline
+
+        COMPLETIONS = 20
+        completions = []
+
+        # tab completes player names, taking the whole line as the name
+        readline.parse_and_bind('tab: complete')
+        readline.set_completer_delims('')
+
         def enter_new_player(c):
             first = input('First name: ')
             last = input('Last name: ')
@@ -114,20 +1214,52 @@ class db:
                 '(firstname, lastname, country) ' 
                 'VALUES (?, ?, ?)', 
                 [first, last, country])
+            self.resolver(c).add(c.lastrowid, first, last)
             return c.lastrowid
 
+        def complete_player(text, state):
+            if state == 0:
+                pids = self.resolver(c).complete(text)[:COMPLETIONS]
+                self.prefetch_names(pids, c)
+                completions[:] = [self.namefl(p, c) for p in pids]
+            if state < len(completions):
+                return completions[state]
+            return None
+
         def get_player(prompt, t_id, c):
             pids = []
 
-            player = input(prompt)
+            readline.set_completer(complete_player)
+            try:
+                player = input(prompt)
+            finally:
+                readline.set_completer(None)
             if not player:
                 return None
 
-            pids = self.get_pids(player, c)
-            if len(pids) == 0:
+            # only exact or prefix matches are taken as they are; a close
+            # name is as likely to be a new player as a typo
+            players = self.resolver(c)
+            pids = players.search(player)
+            suggestions = []
+            if len(pids) == 0 and not any(ch in player for ch in '*?['):
+                suggestions = players.fuzzy(player)
+
+            if len(pids) == 0 and suggestions:
+                for p in suggestions:
+                    print('{} - {}'.format(p, self.namefl(p, c)))
+                choice = input('Player not found - pick a close match, '
+                        'n for a new player, or blank to skip: ')
+                if choice in ['N', 'n']:
+                    pid = enter_new_player(c)
+                elif choice.isdigit() and int(choice) in suggestions:
+                    pid = int(choice)
+                else:
+                    return None
+            elif len(pids) == 0:
                 confirm = input('Player not found - are they new? [y/N]')
                 if confirm in ['Y', 'y']:
-                    pid = [enter_new_player(c)]
+                    pid = enter_new_player(c)
                 else:
                     return None
             elif len(pids) == 1:
@@ -185,66 +1317,133 @@ class db:
 
                 score = input('Enter score in format: '
                         'wo|6-1 6-3 4-1 retd|6-1(1) 6-3(9) 20-18: ')
-                matches = re.match(
-                        r'(?:'
-                        r'(\d+)-(\d+)(?:\((\d+)\))?'
-                        r'(?: (\d+)-(\d+)(?:\((\d+)\))?)?'
-                        r'(?: (\d+)-(\d+)(?:\((\d+)\))?)?'
-                        r'(?: retd)?)|wo', 
-                        score)
-                scores = [score] + list(matches.groups())
-                print('{}-{} ({}) {}-{} ({}) {}-{} ({})'.
-                        format(*matches.groups()))
-
-                c.execute('INSERT OR REPLACE INTO match'
-                        '(round, t_id, winner, loser, score, '
-                        ' score_w_1, score_l_1, score_tb_1,'
-                        ' score_w_2, score_l_2, score_tb_2,'
-                        ' score_w_3, score_l_3, score_tb_3)'
-                        'VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
-                        [round_, t_id, winner, loser] + scores)
+                parsed = parse_score(score)
+                print(' '.join('{}-{} ({})'.format(*s[:3]) 
+                    for s in parsed.sets) or score)
+
+                self.write_match(c, [round_, t_id, winner, loser] + 
+                        list(score_columns(score)))
 
                 w_n = self.namefl(winner, c)
                 l_n = self.namefl(loser, c)
                 confirm = input('{}: {} v. {} - {} OK? [Y/n]: '.format(
                     round_, w_n, l_n, score))
                 if confirm in ['n', 'N']:
-                    self.conn.rollback()
+                    self.rollback()
                 else:
                     self.conn.commit()
 
         c.close()
 
 
-    def insert_file_drawsheet(self, filename, qualies):
-        md, qd = drawsheet.process_pdf(filename, qualies)
+    def insert_file_drawsheet(self, filename, qualies, headless=False,
+            use_cache=True, force=False):
+        """
+        Parse a drawsheet and add it to the database; files unchanged
+        since their last import are skipped unless force is set
+        """
+        import drawsheet
+
+        digest = drawsheet_fingerprint(filename, qualies)
+        if self.skip_unchanged(filename, digest, force):
+            return
+
+        if headless:
+            md, qd = drawsheet.process_pdf_headless(filename, qualies,
+                    use_cache)
+        else:
+            md, qd = drawsheet.process_pdf(filename, qualies, use_cache)
+
+        self.insert_drawsheet_results(filename, digest, md, qd,
+                confirm=not headless)
 
+    def insert_drawsheet_results(self, filename, digest, md, qd, 
+            confirm=True):
+        """
+        Add the main and qualifying draws parsed from filename, and log
+        the import if every draw was saved
+        """
+        t_ids = []
         if md:
             draw, status, meta = md
-            self.database_insert_drawsheet(draw, status, meta, False)
+            t_ids += [self.database_insert_drawsheet(draw, status, meta,
+                False, confirm)]
 
         if qd:
             draw, status, meta = qd
-            self.database_insert_drawsheet(draw, status, meta, True)
+            t_ids += [self.database_insert_drawsheet(draw, status, meta,
+                True, confirm)]
+
+        if t_ids and None not in t_ids:
+            c = self.conn.cursor()
+            self.log_import(c, filename, digest, t_ids)
+            self.conn.commit()
+            c.close()
 
 
-    def database_insert_drawsheet(self, draw, status, meta, qualifying):
+    def insert_files_drawsheet_batch(self, filenames, qualies, jobs=None,
+            use_cache=True, force=False):
         """
-        Enter the drawsheet into the database
+        Parse drawsheets headlessly in a pool of 'jobs' worker processes 
+        (default: one per core) and add them to the database; files 
+        unchanged since their last import are skipped unless force is set.
+
+        Results are written by this process alone, in the order given.
         """
+        import concurrent.futures
+        import drawsheet
+
+        digests = {}
+        for filename in filenames:
+            digest = drawsheet_fingerprint(filename, qualies)
+            if not self.skip_unchanged(filename, digest, force):
+                digests[filename] = digest
+        filenames = [f for f in filenames if f in digests]
+        if not filenames:
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as ex:
+            futures = [ex.submit(drawsheet.process_pdf_headless, f, qualies,
+                        use_cache)
+                    for f in filenames]
+
+            for filename, future in zip(filenames, futures):
+                try:
+                    md, qd = future.result()
+                except Exception as e:
+                    print('{}: FAILED: {}'.format(filename, e))
+                    continue
+
+                if not md and not qd:
+                    print('{}: FAILED: no draw found'.format(filename))
+                    continue
+
+                print()
+                print('{}:'.format(filename))
+                self.insert_drawsheet_results(filename, digests[filename],
+                        md, qd, confirm=False)
+
+
+    def database_insert_drawsheet(self, draw, status, meta, qualifying,
+            confirm=True):
+        """
+        Enter the drawsheet into the database; if confirm is False,
+        save without asking.
+
+        Returns the tournament's t_id, or None if it wasn't saved.
+        """
+        import logging
+
         c = self.conn.cursor()
+        players = self.resolver(c)
 
         def check_player(name, info, t_id):
             stat, country = info
             last, sep, first = name.partition(', ')
 
             added = 0
-            c.execute('SELECT p_id FROM player ' 
-                'WHERE lower(firstname)=? AND lower(lastname)=?', 
-                [first.lower(), last.lower()])
-
-            r = c.fetchone()
-            if r == None: # player is new, insert her
+            p_id = players.lookup(first, last)
+            if p_id == None: # player is new, insert her
                 # capitalize last name properly
                 last = last.lower()
                 last = ' '.join([(n[0].upper() + n[1:]) 
@@ -258,8 +1457,7 @@ class db:
                     'VALUES (?, ?, ?)', 
                     [first, last, country])
                 p_id = c.lastrowid
-            else:
-                p_id = r[0]
+                players.add(p_id, first, last)
 
             c.execute('SELECT * FROM player_tournament ' 
                 'WHERE p_id=? AND t_id=?', [p_id, t_id])
@@ -280,7 +1478,7 @@ class db:
         else:
             print("Adding main draw to database... ")
 
-        match_count = 0
+        counts = collections.Counter()
         player_add_count = 0
 
         # insert the tournament as needed
@@ -295,9 +1493,6 @@ class db:
             p_ids[p], added = check_player(p, info, t_id)
             player_add_count += added
 
-        c.execute('SELECT count(*) FROM match')
-        pre_count = c.fetchone()[0]
-
         for rnd in range(1, len(draw)):
             if qualifying:
                 rnd_string = 'q{}'.format(rnd)
@@ -311,68 +1506,54 @@ class db:
                 except KeyError:
                     loser = None
 
-                scores = parse_score_components(result[2])
+                scores = list(score_columns(result[2]))
                 logging.debug("ADD: {}: {} v. {} - {}".
                             format(rnd_string, winner, loser, scores))
 
-                c.execute('INSERT OR REPLACE INTO match'
-                        '(round, t_id, winner, loser, score, '
-                        ' score_w_1, score_l_1, score_tb_1,'
-                        ' score_w_2, score_l_2, score_tb_2,'
-                        ' score_w_3, score_l_3, score_tb_3)'
-                        'VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
-                        [rnd_string, t_id, winner, loser] + scores)
-                match_count += 1
-
-        c.execute('SELECT count(*) FROM match')
-        post_count = c.fetchone()[0]
-        add_count = post_count - pre_count
-        match_count -= add_count
+                counts[self.write_match(c, 
+                    [rnd_string, t_id, winner, loser] + scores)] += 1
 
         print('Done! {} matches updated, {} matches added, {} players added.'.
-                format(match_count, add_count, player_add_count))
+                format(counts['updated'], counts['added'], player_add_count))
+
+        if confirm:
+            all_correct = input('Save? [Y/n]: ')
+        else:
+            all_correct = 'y'
 
-        all_correct = input('Save? [Y/n]: ')
         if all_correct in ('n', 'N'):
-            self.conn.rollback()
+            self.rollback()
+            t_id = None
         else:
             self.conn.commit()
 
         c.close()
+        return t_id
 
 
-    def insert_file_text_data(self, filename):
-        self.insert_file_text_data_encoding(filename, 'latin1')
+    def insert_file_text_data(self, filename, force=False):
+        self.insert_file_text_data_encoding(filename, 'latin1', force)
 
-    def insert_match_text_data(self, c, line, t_id):
-        def parse_insert_player(p, info):
-            last, first = [s.strip() for s in p.split(',')]
-            info = [s.strip().lstrip('[') for s in info.split(']')]
-            if len(info) == 0:
-                country = ''
-                status = ''
-            elif len(info) == 1:
-                country = info[0]
-                status = ''
-            else:
-                country, status = info[:2]
+    def insert_text_match(self, c, match, t_id):
+        """
+        Add a text_match to tournament t_id; returns write_match's result
+        """
+        import logging
 
-            if country.isdigit():
-                status = country
-                country = ''
+        players = self.resolver(c)
 
-            c.execute('SELECT p_id FROM player ' 
-                'WHERE firstname=? AND lastname=?', [first, last])
-            r = c.fetchone()
-            if r == None:
+        def parse_insert_player(p):
+            first, last, country, status = p
+
+            p_id = players.lookup(first, last)
+            if p_id == None:
                 # player is new, insert her
                 c.execute('INSERT INTO player '
                     '(firstname, lastname, country) ' 
                     'VALUES (?, ?, ?)', 
                     [first, last, country])
                 p_id = c.lastrowid
-            else:
-                p_id = r[0]
+                players.add(p_id, first, last)
 
             c.execute('SELECT * FROM player_tournament ' 
                 'WHERE p_id=? AND t_id=?', [p_id, t_id])
@@ -386,136 +1567,255 @@ class db:
                     [p_id, t_id, status])
             return p_id
 
-        def parse_score(score):
-            score = score.strip()
-            if score.replace(' ', '').replace('.', '').isalpha():
-                return [score] + [None] * 8
-            
-            sets = (score.split(' ') + [None] * 3)[:3]
-            results = []
-            for s in sets:
-                if s == None:
-                    results += [None, None, None]
-                else:
-                    if '(' in s:
-                        # tiebreak
-                        games, tb = s.split('(')
-                        tb = tb.rstrip(')')
-                    else:
-                        games = s
-                        tb = None
-
-                    if '-' in games:
-                        w, l = games.split('-')
-                        results += [w, l, tb]
-                    else:
-                        results += [None, None, None]
-
-            return results
-
-        rnd, sep, rest = line.partition('"')
-        rnd = rnd.strip()
-        p1, sep, rest = rest.partition('"')
-        p1_info, sep, rest = rest.partition(' ')
-
-        bye = False
-        if rest.strip() == 'bye;':
-            bye = True
-            score = 'bye'
-            p2 = None
-        else:
-            rest = rest.partition('"')[2]
-            p2, sep, rest = rest.partition('"')
-            p2_info, sep, rest = rest.partition(' ')
-            score = rest.partition(';')[0]
+        p1_id = parse_insert_player(match.p1)
 
-        p1_id = parse_insert_player(p1, p1_info)
-
-        if not bye:
-            p2_id = parse_insert_player(p2, p2_info)
+        if match.p2 is not None:
+            p2_id = parse_insert_player(match.p2)
         else:
             p2_id = None
 
-        score_list = parse_score(score)
-        logging.debug(p1, 'vs', p2)
-        c.execute('INSERT OR REPLACE INTO match'
-                '(round, t_id, winner, loser, score, '
-                ' score_w_1, score_l_1, score_tb_1,'
-                ' score_w_2, score_l_2, score_tb_2,'
-                ' score_w_3, score_l_3, score_tb_3)'
-                'VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
-                [rnd, t_id, p1_id, p2_id, score] + score_list)
-
-    def insert_file_text_data_encoding(self, filename, encoding='utf8'):
-        t_count = 0
-        m_count = 0
-        mu_count = 0
+        logging.debug('%s vs %s', match.p1, match.p2)
+        return self.write_match(c, 
+                [match.round, t_id, p1_id, p2_id, match.score] + match.scores)
+
+    def insert_file_text_data_encoding(self, filename, encoding='utf8',
+            force=False):
+        digest = fingerprint([filename])
+        if self.skip_unchanged(filename, digest, force):
+            return
+
+        counts = collections.Counter()
+        t_ids = []
         c = self.conn.cursor()
-        f = codecs.open(filename, 'r', encoding=encoding)
-        t_id = -1
-        inmatches = False
-        intourney = False
-        upd = False
-        infoline = 0
-        city, t_name, t_country, date, surface, t_class = [''] * 6
-        for line in f:
-            l = line.strip()
-            if l == 'Start':
-                intourney = True
-                continue
+        f = open(filename, encoding=encoding)
+        for record in parse_text_data(f):
+            if isinstance(record, text_tournament):
+                t_id = self.tournament_id(c, record, insert=True)
+                t_ids += [t_id]
+            else:
+                counts[self.insert_text_match(c, record, t_id)] += 1
 
-            if not intourney:
-                continue
-            
-            if l == ':':
-                c.execute('SELECT t_id FROM tournament WHERE '
-                        'city=? AND name=? AND country=? AND '
-                        'date=? AND surface=? AND class=?',
-                        [city, t_name, t_country, date, surface, t_class])
-                r = c.fetchone()
-                if r == None:
-                    c.execute('INSERT INTO tournament'
-                            '(city, name, country, date, surface, class)'
-                            'VALUES (?,?,?,?,?,?)', 
-                            [city, t_name, t_country, date, surface, t_class])
-                    t_id = c.lastrowid
+        print('{}: Added {} matches and updated {} matches in {} tournaments'.
+                format(filename, counts['added'], counts['updated'], 
+                    len(t_ids)))
+        f.close()
+        self.log_import(c, filename, digest, t_ids)
+        self.conn.commit()
+        c.close()
+
+    def insert_file_text_data_bulk(self, filename, encoding='latin1',
+            force=False, jobs=1):
+        """
+        Load a whole text-data file in a single transaction, through
+        insert_text_records_bulk.
+
+        With jobs other than 1, the file is split into tournament blocks 
+        that are parsed in a pool of 'jobs' worker processes (None is 
+        one per core). Their records are still written by this process
+        alone, in file order, so players are matched up just as they
+        are in a serial load.
+        """
+        import concurrent.futures
+        import os
+        import time
+
+        digest = fingerprint([filename])
+        if self.skip_unchanged(filename, digest, force):
+            return
+
+        def parsed_blocks(ex, workers):
+            # keep a couple of blocks per worker in flight, so memory 
+            # stays bounded when the writer is the slower side
+            pending = collections.deque()
+            for start, end in text_blocks(filename, self.TEXT_BLOCK_SIZE):
+                pending.append(ex.submit(parse_text_block, filename, 
+                    start, end, encoding))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+        start_time = time.perf_counter()
+        c = self.conn.cursor()
+        try:
+            if jobs == 1:
+                f = open(filename, encoding=encoding)
+                try:
+                    counts, t_ids = self.insert_text_records_bulk(c, 
+                            parse_text_data(f))
+                finally:
+                    f.close()
+            else:
+                workers = jobs or os.cpu_count() or 1
+                with concurrent.futures.ProcessPoolExecutor(workers) as ex:
+                    counts, t_ids = self.insert_text_records_bulk(c,
+                            parsed_blocks(ex, workers))
+            self.log_import(c, filename, digest, t_ids)
+        except:
+            self.rollback()
+            raise
+
+        self.conn.commit()
+        c.close()
+
+        elapsed = time.perf_counter() - start_time
+        print('{}: Added {} matches and updated {} matches in {} tournaments'.
+                format(filename, counts['added'], counts['updated'], 
+                    len(t_ids)))
+        print('{}: {} rows in {:.2f}s ({:.0f} rows/sec)'.
+                format(filename, counts['rows'], elapsed,
+                    counts['rows'] / elapsed if elapsed else 0))
+
+    def insert_text_records_bulk(self, c, records):
+        """
+        Write a stream of parse_text_data records; the caller commits.
+
+        Players are resolved through the player_resolver, and rows are
+        written with executemany in batches of BULK_BATCH, so there are
+        no per-record round trips. Each batch is
+        diffed against the matches already stored for its tournaments,
+        and only new or changed matches are written.
+
+        The per-row match insert triggers are suspended for the load;
+        each batch's new matches are added to player_vs_record in one 
+        grouped upsert, and mark the ratings dirty once, instead. Their
+        match_set rows are written in the same batches.
+
+        Returns (counts, t_ids): a Counter of 'rows' read and matches 
+        'added' and 'updated', and the t_id of each tournament in turn.
+        """
+        BULK_BATCH = 10000
+
+        triggers = self.drop_triggers(c, ['match_record_insert', 
+            'match_rating_insert'])
+
+        players = self.resolver(c)
+        c.execute('SELECT max(p_id) FROM player')
+        next_pid = (c.fetchone()[0] or 0) + 1
+
+        new_players = []
+        entries = []
+        matches = []
+        entered = set()
+        counts = collections.Counter()
+        t_ids = []
+
+        def flush():
+            c.executemany('INSERT INTO player'
+                    '(p_id, firstname, lastname, country) '
+                    'VALUES (?, ?, ?, ?)', new_players)
+            c.executemany('INSERT INTO player_tournament'
+                    '(p_id, t_id, status) VALUES (?, ?, ?)', entries)
+
+            stored = {}
+            record_keys = {}
+            days = {}
+            batch_t_ids = list({m[1] for m in matches})
+            for i in range(0, len(batch_t_ids), 256):
+                marks, params = in_list(batch_t_ids[i:i + 256])
+                c.execute('SELECT ' + ', '.join(MATCH_KEY + MATCH_SCORE) +
+                        ' FROM match WHERE t_id IN (' + marks + ')', params)
+                for r in c:
+                    stored[tuple(r[:4])] = list(r[4:])
+                c.execute('SELECT t_id, ' + RECORD_SURFACE + ', ' + 
+                        RECORD_YEAR + ', day FROM tournament '
+                        'WHERE t_id IN (' + marks + ')', params)
+                for t_id, surface, year, day in c:
+                    record_keys[t_id] = (surface, year)
+                    days[t_id] = day
+
+            added = []
+            updated = []
+            for m in matches:
+                key = tuple(m[:4])
+                if key not in stored:
+                    added.append(m)
+                elif stored[key] != m[4:]:
+                    updated.append(m)
                 else:
-                    t_id = r[0]
-                    upd = True
-                    
-                inmatches = True
-                continue
+                    continue
+                stored[key] = m[4:]
+
+            c.executemany('INSERT INTO match(' + 
+                    ', '.join(MATCH_KEY + MATCH_SCORE) + ') '
+                    'VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)', added)
+
+            # what the insert triggers would have done for them
+            added_days = [days[m[1]] for m in added 
+                    if days[m[1]] is not None]
+            if added_days:
+                c.execute(rating_dirty_sql('?'), [min(added_days)] * 3)
+            records = collections.defaultdict(lambda: [0, 0])
+            for rnd, t_id, winner, loser in (m[:4] for m in added):
+                if loser is not None:
+                    surface, year = record_keys[t_id]
+                    records[(winner, loser, surface, year)][0] += 1
+                    records[(loser, winner, surface, year)][1] += 1
+            c.executemany('INSERT INTO player_vs_record'
+                    '(p_id, opp_id, surface, year, wins, losses) '
+                    'VALUES (?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT(p_id, opp_id, surface, year) DO UPDATE '
+                    'SET wins=wins + excluded.wins, '
+                    'losses=losses + excluded.losses',
+                    [k + tuple(v) for k, v in records.items()])
+
+            c.executemany('UPDATE match SET ' + 
+                    ', '.join(s + '=?' for s in MATCH_SCORE) + ' '
+                    'WHERE round=? AND t_id=? AND winner=? AND loser IS ?',
+                    [m[4:] + m[:4] for m in updated])
+            self.write_sets(c, added, replace=False)
+            self.write_sets(c, updated)
+            counts['added'] += len(added)
+            counts['updated'] += len(updated)
+            counts['rows'] += len(matches)
+
+            del new_players[:]
+            del entries[:]
+            del matches[:]
+
+        def player_id(p, t_id):
+            nonlocal next_pid
+            first, last, country, status = p
+            p_id = players.lookup(first, last)
+            if p_id is None:
+                p_id = next_pid
+                next_pid += 1
+                players.add(p_id, first, last)
+                new_players.append((p_id, first, last, country))
+
+            if (p_id, t_id) not in entered:
+                entered.add((p_id, t_id))
+                entries.append((p_id, t_id, status))
+            return p_id
 
-            if l == 'Stop':
-                inmatches = False
-                intourney = False
-                upd = False
-                t_id = -1
-                infoline = 0
-                t_count += 1
-                city, t_name, t_country, date, surface, t_class = [''] * 6
+        for record in records:
+            if isinstance(record, text_tournament):
+                t_id = self.tournament_id(c, record, insert=False)
+                if t_id is None:
+                    t_id = self.tournament_id(c, record, insert=True)
+                else:
+                    c.execute('SELECT p_id FROM player_tournament '
+                            'WHERE t_id=?', [t_id])
+                    entered.update((p_id, t_id) for (p_id,) in c)
+                t_ids.append(t_id)
                 continue
 
-            if not inmatches:
-                if infoline == 0:
-                    city, t_name, t_country = [s.strip() for s in l.split(';')[:3]]
-                    infoline = 1
-                elif infoline == 1:
-                    date, surface, t_class = [s.strip() for s in l.split(';')[:3]]
-                    infoline = 2
+            p1_id = player_id(record.p1, t_id)
+            if record.p2 is not None:
+                p2_id = player_id(record.p2, t_id)
             else:
-                self.insert_match_text_data(c, l, t_id)
+                p2_id = None
 
-                if upd:
-                    mu_count += 1
-                else:
-                    m_count += 1
+            matches.append([record.round, t_id, p1_id, p2_id, 
+                record.score] + record.scores)
 
-        print('{}: Added {} matches and updated {} matches in {} tournaments'.
-                format(filename, m_count, mu_count, t_count))
-        f.close()
-        self.conn.commit()
-        c.close()
+            if len(matches) >= BULK_BATCH:
+                flush()
+
+        flush()
+        for trigger in triggers:
+            c.execute(trigger)
+        return counts, t_ids
 
     def tournament_id(self, cursor, info, insert):
         city, t_name, t_country, date, surface, t_class = info
@@ -536,84 +1836,95 @@ class db:
         else:
             return r[0]
 
-    def namefil(self, pid, c = None):
+    def cache_name(self, pid, name):
+        self.name_cache[pid] = name
+        self.name_cache.move_to_end(pid)
+        if len(self.name_cache) > self.NAME_CACHE_SIZE:
+            self.name_cache.popitem(last=False)
+
+    def prefetch_names(self, pids, c = None):
+        """
+        Load the names of all of pids into the name cache with as few 
+        queries as possible
+        """
+        if c == None:
+            c = self.conn.cursor()
+
+        missing = list({p for p in pids 
+            if p is not None and p not in self.name_cache})
+
+        # stay under sqlite's limit on bound parameters
+        for i in range(0, len(missing), 256):
+            marks, params = in_list(missing[i:i + 256])
+            c.execute('SELECT p_id, firstname, lastname FROM player '
+                    'WHERE p_id IN (' + marks + ')', params)
+            for p_id, first, last in c.fetchall():
+                self.cache_name(p_id, (first, last))
+
+    def player_name(self, pid, c = None):
+        """
+        Return (firstname, lastname) for pid, or None
+        """
+        if pid in self.name_cache:
+            self.name_cache.move_to_end(pid)
+            return self.name_cache[pid]
+
         if c == None:
             c = self.conn.cursor()
 
         c.execute('SELECT firstname, lastname FROM player WHERE p_id=?',
                 (pid,))
         n = c.fetchone()
+        if n != None:
+            self.cache_name(pid, n)
+
+        return n
+
+    def namefil(self, pid, c = None):
+        n = self.player_name(pid, c)
         if n == None:
             return ''
 
         return n[0][0] + '. ' + n[1]
 
     def namefl(self, pid, c = None):
-        if c == None:
-            c = self.conn.cursor()
-
-        c.execute('SELECT firstname, lastname FROM player WHERE p_id=?', (pid,))
-        n = c.fetchone()
+        n = self.player_name(pid, c)
         if n == None:
             return ''
 
         return n[0] + ' ' + n[1]
 
     def namelf(self, pid, c = None):
-        if c == None:
-            c = self.conn.cursor()
-
-        c.execute('SELECT firstname, lastname FROM player WHERE p_id=?',
-                (pid,))
-        n = c.fetchone()
+        n = self.player_name(pid, c)
         if n == None:
             return ''
 
         return n[1] + ', ' + n[0]
 
 
-    def get_pids(self, name, c = None):
-        if c == None:
-            c = self.conn.cursor()
-
-        if ',' in name:
-            l, f = [s.strip() for s in name.split(',', 1)]
-        else:
-            if ' ' in name:
-                f, l = [s.strip() for s in name.split(' ', 1)]
-            else:
-                l = name.strip()
-                f = None
-
-        if f == None:
-            c.execute('SELECT p_id FROM player WHERE lastname GLOB ?', 
-                    [l + '*'])
-
-            a = c.fetchall()
-            if a == []:
-                c.execute('SELECT p_id FROM player WHERE firstname GLOB ?', 
-                        [l + '*'])
-                a = c.fetchall()
-        else:
-            c.execute('SELECT p_id FROM player '
-                    'WHERE firstname GLOB ? AND lastname GLOB ?', 
-                    [f, l])
-
-            a = c.fetchall()
-            if a == []:
-                c.execute('SELECT p_id FROM player '
-                        'WHERE firstname GLOB ? AND lastname GLOB ?', 
-                        [f + '*', l + '*'])
-                a = c.fetchall()
-
-        return [i[0] for i in a]
-
-    def print_matches(self, pid, n=None, start=None, end=None):
+    def get_pids(self, name, c = None, announce=True):
+        """
+        p_ids matching a PLAYER argument; if nothing matches, the closest
+        names by trigram similarity, best first, saying so unless 
+        announce is off
+        """
+        players = self.resolver(c)
+        pids = players.search(name)
+        if pids == [] and not any(ch in name for ch in '*?['):
+            pids = players.fuzzy(name)
+            if pids and announce:
+                self.prefetch_names(pids, c)
+                print('No exact match for {}, using closest: {}'.format(
+                    name, ', '.join(self.namefl(p, c) for p in pids)))
+        return pids
+
+    def matches(self, pid, n=None, start=None, end=None):
+        """
+        pid's last n matches, newest first, as (date, city, class, round, 
+        winner, winner status, loser, loser status, score, surface)
+        """
         c = self.conn.cursor()
-        if n:
-            limit = 'LIMIT {}'.format(n)
-        else:
-            limit = ''
+        d_c, d_params = date_filter(start, end)
 
         c.execute('SELECT date, city, class, round, '
                 ' winner, p1.status AS p1s, '
@@ -626,11 +1937,17 @@ class db:
                     'INNER JOIN player_tournament AS p2 ON '
                         'p2.p_id=match.loser AND '
                         'p2.t_id=match.t_id '
-                'WHERE (winner==? OR loser==?) '
-                + get_date_clause(start, end) +
-                'ORDER BY date DESC ' + limit, 
-                [pid, pid])
+                'WHERE (winner==? OR loser==?) ' + d_c +
+                'ORDER BY date DESC LIMIT ?', 
+                [pid, pid] + d_params + [n or -1])
         matches = c.fetchall()
+        self.prefetch_names([m[4] for m in matches] + [m[6] for m in matches],
+                c)
+        c.close()
+        return matches
+
+    def print_matches(self, pid, n=None, start=None, end=None):
+        matches = self.matches(pid, n, start, end)
 
         for m in matches:
             print('{} - {} {}: {} {}({}) d. {}({}) {} {}'.format(
@@ -643,6 +1960,7 @@ class db:
         pids = []
         for p in players:
             pids += self.get_pids(p, c)
+        self.prefetch_names(pids, c)
 
         for p in pids:
             print()
@@ -651,12 +1969,13 @@ class db:
 
     def action_tournament(self, t_fuzzy, start, end):
         c = self.conn.cursor()
+        d_c, d_params = date_filter(start, end)
 
         c.execute('SELECT t_id, city, country, name, class FROM tournament WHERE '
                 '(city=? OR name=? OR country=? OR '
-                'surface=? OR class=?) ' + get_date_clause(start, end)
+                'surface=? OR class=?) ' + d_c
                 + ' ORDER BY date ASC'
-                , [t_fuzzy, t_fuzzy, t_fuzzy, t_fuzzy, t_fuzzy])
+                , [t_fuzzy, t_fuzzy, t_fuzzy, t_fuzzy, t_fuzzy] + d_params)
         tournaments = c.fetchall()
 
         for t, city, country, name, class_ in tournaments:
@@ -676,6 +1995,8 @@ class db:
                     'ORDER BY round ASC ', 
                     [t])
             matches = c.fetchall()
+            self.prefetch_names([m[4] for m in matches] + 
+                    [m[6] for m in matches], c)
 
             for m in matches:
                 print('{} - {} {}: {} {}({}) d. {}({}) {} {}'.format(
@@ -684,51 +2005,49 @@ class db:
             print()
 
 
-    def print_record(self, pid, start, end):
-        def make_percent(wins, losses):
-            if wins + losses == 0:
-                return 'Inf'
-            else:
-                return float(wins) / (wins + losses)
+    def records(self, pids, start=None, end=None):
+        """
+        Win/loss records for all of pids in a single grouped scan.
 
+        Returns {pid: {surface: (wins, losses)}}
+        """
         c = self.conn.cursor()
-        c.execute('SELECT count(*) ' 
-                'FROM match NATURAL INNER JOIN tournament '
-                'WHERE winner=? AND loser IS NOT NULl'
-                + get_date_clause(start, end)
-                , [pid])
-        wins = c.fetchone()[0]
-
-        c.execute('SELECT count(*) ' 
-                'FROM match NATURAL INNER JOIN tournament WHERE loser=?'
-                + get_date_clause(start, end)
-                , [pid])
-        losses = c.fetchone()[0]
-
-
-        c.execute('SELECT surface, count(*) ' 
-                'FROM match NATURAL INNER JOIN tournament WHERE winner=? '
-                + get_date_clause(start, end) +
-                'AND loser IS NOT NULl GROUP BY surface', [pid])
-        surface_wins = dict(c.fetchall())
-
-        c.execute('SELECT surface, count(*) ' 
-                'FROM match NATURAL INNER JOIN tournament '
-                'WHERE loser=? '
-                + get_date_clause(start, end) +
-                'GROUP BY surface', [pid])
-        surface_losses = dict(c.fetchall())
-
-        surface_record = {}
-        for s, w in surface_wins.items():
-            if s in surface_losses:
-                surface_record[s] = (w, surface_losses[s])
-                del surface_losses[s]
-            else:
-                surface_record[s] = (w, 0)
+        records = {p: {} for p in pids}
+        pids = list(records)
+        d_c, d_params = date_filter(start, end)
+
+        for i in range(0, len(pids), 256):
+            marks, params = in_list(pids[i:i + 256])
+            c.execute('SELECT p_id, surface, sum(won), sum(lost) FROM ('
+                    'SELECT winner AS p_id, t_id, 1 AS won, 0 AS lost '
+                        'FROM match '
+                        'WHERE winner IN (' + marks + ') '
+                        'AND loser IS NOT NULL '
+                    'UNION ALL '
+                    'SELECT loser AS p_id, t_id, 0 AS won, 1 AS lost '
+                        'FROM match '
+                        'WHERE loser IN (' + marks + ')'
+                    ') NATURAL INNER JOIN tournament '
+                    'WHERE 1 ' + d_c + 
+                    'GROUP BY p_id, surface', params * 2 + d_params)
+
+            for p, surface, w, l in c.fetchall():
+                records[p][surface] = (w, l)
+
+        c.close()
+        return records
+
+    def print_record(self, pid, start, end, record=None):
+        """
+        Print a player's record; record is her entry from records(), 
+        which is looked up if not given
+        """
+        if record is None:
+            record = self.records([pid], start, end)[pid]
 
-        for s, w in surface_losses.items():
-            surface_record[s] = (0, w)
+        surface_record = record
+        wins = sum(w for w, l in record.values())
+        losses = sum(l for w, l in record.values())
 
         print("Overall Record: {} matches played, {}-{} ({:.3})".
                 format(wins + losses, wins, losses, 
@@ -769,9 +2088,11 @@ class db:
         pids = []
         for p in players:
             pids += self.get_pids(p, c)
+        self.prefetch_names(pids, c)
 
+        records = self.records(pids, start, end)
         for p in pids:
-            self.print_record(p, start, end)
+            self.print_record(p, start, end, records[p])
 
 
     def action_profile(self, players, start, end):
@@ -780,6 +2101,8 @@ class db:
         pids = []
         for p in players:
             pids += self.get_pids(p, c)
+        self.prefetch_names(pids, c)
+        records = self.records(pids, start, end)
 
         for p in pids:
             print()
@@ -790,54 +2113,309 @@ class db:
             country = c.fetchone()[0]
 
             print("Country: {}".format(country))
-            self.print_record(p, start, end)
+            self.print_record(p, start, end, records[p])
             print()
             print("Last 10 matches:")
             self.print_matches(p, 10, start=start, end=end)
 
         c.close()
 
+    def set_stats(self, pids, start=None, end=None, surface=None):
+        """
+        set_stats for all of pids, from match_set in a single grouped 
+        query per 256 players.
+
+        Deciding sets are the last sets of matches that were level
+        going into them; retirements have none, and their unfinished
+        set is no bagel or breadstick. Returns {pid: set_stats}.
+        """
+        c = self.conn.cursor()
+        stats = {p: set_stats(*[0] * len(set_stats._fields)) for p in pids}
+        pids = list(stats)
+        d_c, d_params = date_filter(start, end)
+        s_c, s_params = surface_filter(surface)
+
+        for i in range(0, len(pids), 256):
+            marks, params = in_list(pids[i:i + 256])
+            # each set from the player's side (f games for, a against),
+            # then each match, then each player
+            c.execute('SELECT p_id, count(*), sum(tb_won), sum(tb_lost), '
+                    'sum(side AND complete AND w_sets = l_sets + 1 '
+                        'AND l_sets > 0), '
+                    'sum(NOT side AND complete AND w_sets = l_sets + 1 '
+                        'AND l_sets > 0), '
+                    'sum(bagels_won), sum(bagels_lost), '
+                    'sum(breadsticks_won), sum(breadsticks_lost), '
+                    'sum(games_won), sum(games_lost), '
+                    'sum(side AND set_down), sum(set_down) FROM ('
+                'SELECT p_id, side, '
+                    'sum(f = 7 AND a = 6) AS tb_won, '
+                    'sum(f = 6 AND a = 7) AS tb_lost, '
+                    'sum(finished AND f = 6 AND a = 0) AS bagels_won, '
+                    'sum(finished AND f = 0 AND a = 6) AS bagels_lost, '
+                    'sum(finished AND f = 6 AND a = 1) AS breadsticks_won, '
+                    'sum(finished AND f = 1 AND a = 6) AS breadsticks_lost, '
+                    'sum(f) AS games_won, sum(a) AS games_lost, '
+                    'min(finished) AS complete, '
+                    'sum(won > lost) AS w_sets, sum(won < lost) AS l_sets, '
+                    'max(set_no = 1 AND finished AND f < a) AS set_down '
+                'FROM (SELECT p_id, side, m.round, m.t_id, m.winner, '
+                        'm.loser, set_no, won, lost, finished, '
+                        'CASE WHEN side THEN won ELSE lost END AS f, '
+                        'CASE WHEN side THEN lost ELSE won END AS a '
+                    'FROM (SELECT winner AS p_id, 1 AS side, round, t_id, '
+                            'winner, loser FROM match '
+                            'WHERE winner IN (' + marks + ') '
+                            'AND loser IS NOT NULL '
+                        'UNION ALL '
+                        'SELECT loser AS p_id, 0 AS side, round, t_id, '
+                            'winner, loser FROM match '
+                            'WHERE loser IN (' + marks + ')'
+                    ') m INNER JOIN tournament t ON t.t_id=m.t_id '
+                    'INNER JOIN match_set s ON s.t_id=m.t_id '
+                        'AND s.round=m.round AND s.winner=m.winner '
+                        'AND s.loser=m.loser '
+                    'WHERE 1 ' + d_c + s_c + ') '
+                'GROUP BY p_id, side, round, t_id, winner, loser) '
+                'GROUP BY p_id', params * 2 + d_params + s_params)
+
+            for r in c.fetchall():
+                stats[r[0]] = set_stats(*r[1:])
+
+        c.close()
+        return stats
+
+    def action_set_stats(self, players, start, end, surface=None):
+        """
+        Print set-level stats for players: tiebreaks, deciding sets, 
+        bagels and breadsticks, games won and comebacks
+        """
+        pids = []
+        for p in players:
+            pids += self.get_pids(p)
+        self.prefetch_names(pids)
+        stats = self.set_stats(pids, start, end, surface)
+
+        on = ' on ' + surface if surface else ''
+        for p in pids:
+            s = stats[p]
+            print()
+            print('Set stats for {}{}: {} matches with set scores'.format(
+                self.namefl(p), on, s.matches))
+            print('\tTiebreaks: {}-{} ({:.3})'.format(s.tiebreaks_won, 
+                s.tiebreaks_lost, make_percent(s.tiebreaks_won, 
+                    s.tiebreaks_lost)))
+            print('\tDeciding sets: {}-{} ({:.3})'.format(s.deciders_won,
+                s.deciders_lost, make_percent(s.deciders_won, 
+                    s.deciders_lost)))
+            print('\tBagels: {} won, {} lost'.format(s.bagels_won, 
+                s.bagels_lost))
+            print('\tBreadsticks: {} won, {} lost'.format(s.breadsticks_won,
+                s.breadsticks_lost))
+            print('\tGames won: {} of {} ({:.3})'.format(s.games_won,
+                s.games_won + s.games_lost, make_percent(s.games_won, 
+                    s.games_lost)))
+            print('\tComebacks: won {} of {} matches after losing the '
+                    'first set ({:.3})'.format(s.comebacks, s.set_down,
+                        make_percent(s.comebacks, 
+                            s.set_down - s.comebacks)))
+
+    def undefeated(self, pids=None, start=None, end=None):
+        """
+        Find who each player is undefeated against, from one grouped 
+        pass over match; pids None means every player.
+
+        Returns {pid: (beaten, lost_to)}, where beaten maps each opponent
+        she has never lost to to her wins against them, and lost_to maps
+        each opponent she has never beaten to her losses against them.
+        """
+        c = self.conn.cursor()
+        d_c, d_params = date_filter(start, end)
+
+        if pids is None:
+            c.execute('SELECT winner, loser, count(*) '
+                    'FROM match NATURAL INNER JOIN tournament '
+                    'WHERE loser IS NOT NULL ' + d_c +
+                    'GROUP BY winner, loser', d_params)
+            rows = c.fetchall()
+        else:
+            rows = []
+            for i in range(0, len(pids), 256):
+                marks, params = in_list(pids[i:i + 256])
+                c.execute('SELECT winner, loser, count(*) FROM ('
+                        'SELECT round, t_id, winner, loser FROM match '
+                            'WHERE winner IN (' + marks + ') '
+                            'AND loser IS NOT NULL '
+                        'UNION '
+                        'SELECT round, t_id, winner, loser FROM match '
+                            'WHERE loser IN (' + marks + ')'
+                        ') NATURAL INNER JOIN tournament '
+                        'WHERE 1 ' + d_c +
+                        'GROUP BY winner, loser', params * 2 + d_params)
+                rows += c.fetchall()
+        c.close()
+
+        won = collections.defaultdict(dict)
+        lost = collections.defaultdict(dict)
+        for w, l, n in rows:
+            won[w][l] = n
+            lost[l][w] = n
+
+        if pids is None:
+            pids = set(won) | set(lost)
+
+        result = {}
+        for p in pids:
+            beaten = {o: n for o, n in won[p].items() if o not in lost[p]}
+            lost_to = {o: n for o, n in lost[p].items() if o not in won[p]}
+            result[p] = (beaten, lost_to)
+
+        return result
+
     def action_undefeated(self, players, start, end):
         c = self.conn.cursor()
 
         pids = []
         for p in players:
             pids += self.get_pids(p, c)
+        self.prefetch_names(pids, c)
 
+        undefeated = self.undefeated(pids, start, end)
         for p in pids:
+            beaten, lost_to = undefeated[p]
+            self.prefetch_names(list(beaten) + list(lost_to), c)
+
             print()
             print("Players {} is undefeaded vs.:".format(self.namefl(p)))
-            c.execute("""
-                SELECT loser, count(winner)
-                FROM match as w
-                WHERE winner=? AND loser IS NOT NULL AND NOT EXISTS (
-                    SELECT * FROM match NATURAL INNER JOIN tournament as l 
-                        WHERE loser=? AND l.winner=w.loser """
-                        + get_date_clause(start, end) + """)
-                GROUP BY loser
-                ORDER BY count(winner) DESC""", [p] * 2)
-
-            players = c.fetchall()
-            for pl in players:
-                print("{}-0 vs. {}".format(pl[1], self.namefl(pl[0])))
+            for o, n in sorted(beaten.items(), key=lambda a: -a[1]):
+                print("{}-0 vs. {}".format(n, self.namefl(o)))
 
             print()
             print("Players undefeaded vs. {}:".format(self.namefl(p)))
-            c.execute("""
-                SELECT winner, count(loser)
-                FROM match as l
+            for o, n in sorted(lost_to.items(), key=lambda a: -a[1]):
+                print("0-{} vs. {}".format(n, self.namefl(o)))
+
+        c.close()
+
+    def action_undefeated_all(self, start, end):
+        """
+        List every player's undefeated-vs set
+        """
+        c = self.conn.cursor()
+
+        undefeated = self.undefeated(None, start, end)
+        self.prefetch_names(undefeated, c)
+        by_name = sorted(undefeated.items(), 
+                key=lambda a: self.namelf(a[0]))
+
+        for p, (beaten, lost_to) in by_name:
+            if not beaten:
+                continue
+
+            print()
+            print("Players {} is undefeaded vs.:".format(self.namefl(p)))
+            self.prefetch_names(beaten, c)
+            for o, n in sorted(beaten.items(), key=lambda a: -a[1]):
+                print("{}-0 vs. {}".format(n, self.namefl(o)))
+
+        c.close()
+
+    def best_worst_by_date(self, c, p, n, order, start, end):
+        """
+        Per-opponent records for p straight from match, for date ranges
+        that player_vs_record can't answer
+        """
+        d_c, d_params = date_filter(start, end)
+
+        # sqlite doesn't support FULL OUTER JOIN, this is the workaround
+        c.execute("""
+     SELECT wins.opponent, wins.win_count, losses.loss_count
+        FROM (SELECT winner as player, 
+                loser as opponent, count(*) as win_count
+                FROM match NATURAL INNER JOIN tournament
+                WHERE winner=? AND loser IS NOT NULL """ + d_c + """
+                GROUP BY loser
+            UNION ALL 
+            SELECT DISTINCT loser as player, 
+                    winner as opponent, 0 as win_count
+                FROM match as l NATURAL INNER JOIN tournament
                 WHERE loser=? AND NOT EXISTS (
-                    SELECT * FROM match NATURAL INNER JOIN tournament as w 
-                        WHERE winner=? AND w.loser=l.winner """
-                        + get_date_clause(start, end) + """)
+                    SELECT * FROM match as w NATURAL INNER JOIN tournament
+                        WHERE winner=? AND w.loser=l.winner """ + d_c + """)
+                    """ + d_c + """
+            ) AS wins
+            INNER JOIN
+            (SELECT loser as player, winner as opponent, 
+                    count(*) as loss_count
+                FROM match NATURAL INNER JOIN tournament
+                WHERE loser=? """ + d_c + """
                 GROUP BY winner
-                ORDER BY count(winner) DESC""", [p] * 2)
+            UNION ALL 
+            SELECT DISTINCT winner as player, loser as opponent, 
+                    0 as loss_count
+                FROM match as w NATURAL INNER JOIN tournament
+                WHERE winner=? AND loser IS NOT NULL AND NOT EXISTS (
+                    SELECT * FROM match as l NATURAL INNER JOIN tournament
+                        WHERE loser=? AND l.winner=w.loser """ + d_c + """)
+                    """ + d_c + """
+            ) AS losses
+            ON wins.player==losses.player 
+                AND wins.opponent==losses.opponent """
+        + order + " LIMIT ?", 
+        [p] + d_params + [p, p] + d_params * 2 + 
+        [p] + d_params + [p, p] + d_params * 2 + [n])
+
+    def best_worst(self, pids, n, operation='best', start=None, end=None):
+        """
+        Each of pids' n best, worst or biggest rival opponents.
+
+        Returns {pid: [(opponent, wins, losses), ...]}; raises ValueError
+        for an unknown operation.
+        """
+        if operation == 'best':
+            order = ('ORDER BY (win_count - loss_count) DESC, '
+                    '(win_count + loss_count) DESC')
+        elif operation == 'worst':
+            order = ('ORDER BY (win_count - loss_count) ASC, '
+                    '(win_count + loss_count) DESC')
+        elif operation == 'rivals':
+            order = ('ORDER BY '
+                'rivals_sort(win_count, loss_count) DESC')
+        else:
+            raise ValueError('invalid op in best_worst(): ' + operation)
+
+        c = self.conn.cursor()
+        n = int(n)
+        years = year_bounds(start, end)
+        y_c = ''
+        y_params = []
+        if years is not None:
+            first, last = years
+            if first is not None:
+                y_c += ' AND year >= ?'
+                y_params += [first]
+            if last is not None:
+                y_c += ' AND year <= ?'
+                y_params += [last]
+
+        results = {}
+        for p in pids:
+            if years is not None:
+                # served from the materialized per-opponent records
+                c.execute('SELECT opp_id, sum(wins) AS win_count, '
+                        'sum(losses) AS loss_count '
+                        'FROM player_vs_record '
+                        'WHERE p_id=? ' + y_c +
+                        ' GROUP BY opp_id '
+                        + order + " LIMIT ?", [p] + y_params + [n])
+            else:
+                self.best_worst_by_date(c, p, n, order, start, end)
 
-            players = c.fetchall()
-            for p in players:
-                print("0-{} vs. {}".format(p[1], self.namefl(p[0])))
+            results[p] = c.fetchall()
+            self.prefetch_names([e[0] for e in results[p]], c)
 
         c.close()
+        return results
 
     def action_best_worst(self, players, n, operation='best', start=None, end=None):
         c = self.conn.cursor()
@@ -845,60 +2423,17 @@ class db:
         pids = []
         for p in players:
             pids += self.get_pids(p, c)
+        self.prefetch_names(pids, c)
 
-        if operation == 'best':
-            order = ('ORDER BY (wins.win_count - losses.loss_count) DESC, '
-                    '(wins.win_count + losses.loss_count) DESC')
-        elif operation == 'worst':
-            order = ('ORDER BY (wins.win_count - losses.loss_count) ASC, '
-                    '(wins.win_count + losses.loss_count) DESC')
-        elif operation == 'rivals':
-            order = ('ORDER BY '
-                'rivals_sort(wins.win_count, losses.loss_count) DESC')
-        else:
+        n = int(n)
+        try:
+            results = self.best_worst(pids, n, operation, start, end)
+        except ValueError:
             print("invalid op in best_worst()")
             return
 
-        d_c = get_date_clause(start, end)
-
         for p in pids:
-            # sqlite doesn't support FULL OUTER JOIN, this is the workaround
-            c.execute("""
-         SELECT wins.opponent, wins.win_count, losses.loss_count
-            FROM (SELECT winner as player, 
-                    loser as opponent, count(*) as win_count
-                    FROM match NATURAL INNER JOIN tournament
-                    WHERE winner=? AND loser IS NOT NULL """ + d_c + """
-                    GROUP BY loser
-                UNION ALL 
-                SELECT DISTINCT loser as player, 
-                        winner as opponent, 0 as win_count
-                    FROM match as l NATURAL INNER JOIN tournament
-                    WHERE loser=? AND NOT EXISTS (
-                        SELECT * FROM match as w NATURAL INNER JOIN tournament
-                            WHERE winner=? AND w.loser=l.winner """ + d_c + """)
-                        """ + d_c + """
-                ) AS wins
-                INNER JOIN
-                (SELECT loser as player, winner as opponent, 
-                        count(*) as loss_count
-                    FROM match NATURAL INNER JOIN tournament
-                    WHERE loser=? """ + d_c + """
-                    GROUP BY winner
-                UNION ALL 
-                SELECT DISTINCT winner as player, loser as opponent, 
-                        0 as loss_count
-                    FROM match as w NATURAL INNER JOIN tournament
-                    WHERE winner=? AND loser IS NOT NULL AND NOT EXISTS (
-                        SELECT * FROM match as l NATURAL INNER JOIN tournament
-                            WHERE loser=? AND l.winner=w.loser """ + d_c + """)
-                        """ + d_c + """
-                ) AS losses
-                ON wins.player==losses.player 
-                    AND wins.opponent==losses.opponent """
-            + order + " LIMIT " + n, [p] * 6)
-
-            recordvs = c.fetchall()
+            recordvs = results[p]
 
             if operation == 'best':
                 print("{} - {} opponents defeated most:".format(self.namefl(p), n))
@@ -914,30 +2449,33 @@ class db:
         c.close()
 
     def action_h2h(self, players, start, end):
+        import itertools
+
         c = self.conn.cursor()
 
         pids = []
         for p in players:
             pids += self.get_pids(p, c)
+        self.prefetch_names(pids, c)
 
 
         if len(pids) > 10:
             print("{} players found: only doing h2h for first 10".format(len(pids)))
             pids = pids[:10]
 
+        d_c, d_params = date_filter(start, end)
+
         for p1, p2 in itertools.combinations(pids, 2):
             c.execute('SELECT count(winner) ' 
                     'FROM match NATURAL INNER JOIN tournament '
-                    'WHERE winner=? AND loser=?'
-                        + get_date_clause(start, end)
-                    , [p1, p2])
+                    'WHERE winner=? AND loser=?' + d_c
+                    , [p1, p2] + d_params)
             p1wins = c.fetchone()[0]
 
             c.execute('SELECT count(winner) ' 
                     'FROM match NATURAL INNER JOIN tournament '
-                    'WHERE winner=? AND loser=?'
-                        + get_date_clause(start, end)
-                    , [p2, p1])
+                    'WHERE winner=? AND loser=?' + d_c
+                    , [p2, p1] + d_params)
             p2wins = c.fetchone()[0]
 
             c.execute('SELECT date, city, class, round, '
@@ -951,10 +2489,9 @@ class db:
                         'INNER JOIN player_tournament AS p2 ON '
                             'p2.p_id=match.loser AND '
                             'p2.t_id=match.t_id '
-                    'WHERE winner IN (?,?) AND loser IN (?,?)' 
-                        + get_date_clause(start, end) + 
+                    'WHERE winner IN (?,?) AND loser IN (?,?)' + d_c +
                     'ORDER BY date DESC', 
-                    [p1, p2] * 2)
+                    [p1, p2] * 2 + d_params)
             matches = c.fetchall()
 
             print(self.namefl(p1) + ' vs. ' + self.namefl(p2))
@@ -972,8 +2509,136 @@ class db:
         c.close()
             
 
+    def h2h_matrix(self, pids, start=None, end=None):
+        """
+        Head-to-head wins between every pair of pids, pulled in one 
+        grouped query per block of 256 x 256 players.
+
+        Returns an N x N numpy array where [i, j] is the number of times
+        pids[i] beat pids[j]. Requires numpy.
+        """
+        import numpy as np
+
+        c = self.conn.cursor()
+        n = len(pids)
+        d_c, d_params = date_filter(start, end)
+        rows = []
+        for i in range(0, n, 256):
+            w_marks, winners = in_list(pids[i:i + 256])
+            for j in range(0, n, 256):
+                l_marks, losers = in_list(pids[j:j + 256])
+                c.execute('SELECT winner, loser, count(*) '
+                        'FROM match NATURAL INNER JOIN tournament '
+                        'WHERE winner IN (' + w_marks + ') '
+                        'AND loser IN (' + l_marks + ')' + d_c +
+                        'GROUP BY winner, loser', 
+                        winners + losers + d_params)
+                rows += c.fetchall()
+        c.close()
+
+        matrix = np.zeros((n, n), dtype=np.int32)
+        if rows:
+            w, l, count = np.array(rows, dtype=np.int64).T
+
+            # map p_ids to matrix positions
+            ids = np.array(pids, dtype=np.int64)
+            order = np.argsort(ids)
+            wi = order[np.searchsorted(ids, w, sorter=order)]
+            li = order[np.searchsorted(ids, l, sorter=order)]
+            np.add.at(matrix, (wi, li), count)
+
+        return matrix
+
+    def action_snapshot(self, directory):
+        """Export a snapshot.py columnar snapshot of the matches"""
+        import time
+
+        try:
+            import snapshot
+        except ImportError:
+            print("numpy is required for snapshots")
+            return
+
+        start_time = time.perf_counter()
+        n = snapshot.export(self, directory)
+        print('{}: wrote {} matches in {:.2f}s'.format(directory, n,
+            time.perf_counter() - start_time))
+
+    def action_export_parquet(self, directory):
+        """Write the database to an archive.py Parquet directory"""
+        import time
+
+        try:
+            import archive
+        except ImportError:
+            print("pyarrow is required for Parquet archives")
+            return
+
+        start_time = time.perf_counter()
+        counts = archive.export(self, directory)
+        print('{}: wrote {} in {:.2f}s'.format(directory, 
+            ', '.join('{} {}'.format(n, t) for t, n in counts.items()),
+            time.perf_counter() - start_time))
+
+    def action_import_parquet(self, directory):
+        """Load an archive.py Parquet directory into an empty database"""
+        import time
+
+        try:
+            import archive
+        except ImportError:
+            print("pyarrow is required for Parquet archives")
+            return
+
+        start_time = time.perf_counter()
+        try:
+            counts = archive.load(self, directory)
+        except ValueError as e:
+            print('{}: not imported, {}'.format(directory, e))
+            return
+        print('{}: read {} in {:.2f}s'.format(directory, 
+            ', '.join('{} {}'.format(n, t) for t, n in counts.items()),
+            time.perf_counter() - start_time))
+
+    def action_h2h_matrix(self, players, fmt, start, end):
+        import csv
+        import json
+
+        c = self.conn.cursor()
+
+        pids = []
+        for p in players:
+            for pid in self.get_pids(p, c):
+                if pid not in pids:
+                    pids += [pid]
+        self.prefetch_names(pids, c)
+        c.close()
+
+        try:
+            matrix = self.h2h_matrix(pids, start, end)
+        except ImportError:
+            print("numpy is required for the h2h matrix")
+            return
+
+        names = [self.namefl(p) for p in pids]
+        if fmt == 'json':
+            json.dump({
+                'players': [{'p_id': p, 'name': name} 
+                    for p, name in zip(pids, names)],
+                'wins': matrix.tolist(),
+                }, sys.stdout)
+            print()
+        else:
+            out = csv.writer(sys.stdout)
+            out.writerow(['wins vs.'] + names)
+            for name, row in zip(names, matrix.tolist()):
+                out.writerow([name] + row)
+
+
+
+def main():
+    import argparse
 
-if __name__ == '__main__':
     parser = argparse.ArgumentParser(
             description='Query a tennis-datafier database')
 
@@ -990,6 +2655,10 @@ if __name__ == '__main__':
             help='Look up profiles for players')
     parser.add_argument('-2', '--h2h', action='store_true',
             help='Look up h2h for given players')
+    parser.add_argument('-m', '--h2h-matrix', metavar='FORMAT',
+            choices=['csv', 'json'],
+            help='Print the full h2h win matrix for given players '
+                 'as csv or json')
     parser.add_argument('-c', '--matches', action='store_true', 
             help='Get complete match record for this player')
     parser.add_argument('-o', '--tournament', metavar='TOURNY', 
@@ -1002,37 +2671,106 @@ if __name__ == '__main__':
             help='Look up the best N opponents for given players')
     parser.add_argument('-u', '--undefeated', action='store_true',
             help='Look up the undefeated records for given players')
+    parser.add_argument('-U', '--undefeated-all', action='store_true',
+            help='List the undefeated records of every player')
+    parser.add_argument('-S', '--set-stats', action='store_true',
+            help='Show tiebreak, deciding set, bagel, games won and '
+                 'comeback stats for PLAYERs')
+    parser.add_argument('-E', '--elo', action='store_true',
+            help='Look up surface elo ratings for given players as of '
+                 'the -e date, or the top rated on each surface if no '
+                 'players are given')
     parser.add_argument('-t', '--text-data', metavar='FILE', action='append',
             help='add a file in the old text-data input format to the db')
+    parser.add_argument('--bulk', action='store_true',
+            help='with -t, load each file in a single bulk transaction')
     parser.add_argument('-9', '--wtadraw', metavar='FILE', action='append',
             help='add a file in wta drawsheet format (requires pdftotext)')
+    parser.add_argument('--headless', action='store_true',
+            help='with -9, import without prompting; metadata comes from '
+                 'the best guess and any FILE.json/FILE.yaml sidecar, and '
+                 'a FILE.report.json confidence report is written')
+    parser.add_argument('--batch', action='store_true',
+            help='with -9, import headlessly, parsing drawsheets '
+                 'in parallel; with -t, bulk load each file, parsing its '
+                 'tournaments in parallel')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=None,
+            help='number of worker processes for --batch '
+                 '(default is one per core)')
+    parser.add_argument('--force', action='store_true',
+            help='with -t or -9, import files even if they are unchanged '
+                 'since their last import')
+    parser.add_argument('--no-cache', action='store_true',
+            help='with -9, always rerun pdftotext instead of using '
+                 'cached text')
+    parser.add_argument('--serve', metavar='[HOST:]PORT',
+            help='Answer queries as a local HTTP JSON API '
+                 '(see server.py)')
+    parser.add_argument('--snapshot', metavar='DIR',
+            help='Export the matches as memory-mappable numpy columns '
+                 '(see snapshot.py)')
+    parser.add_argument('--export-parquet', metavar='DIR',
+            help='Write the whole database as Parquet files '
+                 '(requires pyarrow, see archive.py)')
+    parser.add_argument('--import-parquet', metavar='DIR',
+            help='Load Parquet files written by --export-parquet into '
+                 'an empty database')
+    parser.add_argument('--rebuild', action='store_true',
+            help='Rebuild the derived tables from the match table')
     parser.add_argument('-a', '--add', action='store_true',
             help='add a tournament by hand')
     parser.add_argument('-q', '--qualifying', action='store_true',
             help='Only import qualifying draw')
     parser.add_argument('-s', '--start', metavar="DATE",
             default=None,
-            help='Restrict results to after this date')
+            help='Restrict results to on or after this date '
+                 '(YYYY, YYYY-MM or YYYY-MM-DD)')
     parser.add_argument('-e', '--end', metavar="DATE",
             default=None,
-            help='Restrict results to after this date')
+            help='Restrict results to on or before this date '
+                 '(YYYY, YYYY-MM or YYYY-MM-DD)')
+    parser.add_argument('--surface', metavar='SURFACE', default=None,
+            help='with -S, restrict results to surfaces ending in this '
+                 'one, e.g. Clay for both clays')
 
     args = parser.parse_args()
 
+    for date in (args.start, args.end):
+        if date:
+            try:
+                parse_date(date)
+            except ValueError:
+                parser.error('invalid date: {}'.format(date))
+
     if args.debug:
+        import logging
         logging.basicConfig(level=logging.DEBUG)
 
     d = db(args.database)
 
     if args.text_data:
         for i in args.text_data:
-            d.insert_file_text_data(i)
+            if args.batch:
+                d.insert_file_text_data_bulk(i, force=args.force,
+                        jobs=args.jobs)
+            elif args.bulk:
+                d.insert_file_text_data_bulk(i, force=args.force)
+            else:
+                d.insert_file_text_data(i, args.force)
     elif args.wtadraw:
-        for i in args.wtadraw:
-            d.insert_file_drawsheet(i, args.qualifying)
+        if args.batch:
+            d.insert_files_drawsheet_batch(args.wtadraw, args.qualifying,
+                    args.jobs, not args.no_cache, args.force)
+        else:
+            for i in args.wtadraw:
+                d.insert_file_drawsheet(i, args.qualifying, args.headless,
+                        not args.no_cache, args.force)
     elif args.h2h:
         d.action_h2h(args.players,
                 args.start, args.end)
+    elif args.h2h_matrix:
+        d.action_h2h_matrix(args.players, args.h2h_matrix,
+                args.start, args.end)
     elif args.tournament:
         d.action_tournament(args.tournament, args.start, args.end)
     elif args.profile:
@@ -1053,9 +2791,28 @@ if __name__ == '__main__':
     elif args.undefeated:
         d.action_undefeated(args.players,
                 args.start, args.end)
+    elif args.undefeated_all:
+        d.action_undefeated_all(args.start, args.end)
+    elif args.set_stats:
+        d.action_set_stats(args.players, args.start, args.end, 
+                args.surface)
+    elif args.elo:
+        d.action_ratings(args.players, args.end)
     elif args.add:
         d.insert_tournament_manually()
+    elif args.rebuild:
+        d.action_rebuild()
+    elif args.snapshot:
+        d.action_snapshot(args.snapshot)
+    elif args.export_parquet:
+        d.action_export_parquet(args.export_parquet)
+    elif args.import_parquet:
+        d.action_import_parquet(args.import_parquet)
+    elif args.serve:
+        import server
+        server.serve(d, args.serve)
     else:
         parser.print_help()
 
-
+if __name__ == '__main__':
+    main()